@@ -1,41 +1,43 @@
+import time
 import numpy as np
 import scipy.stats as sps
+from collections import namedtuple
+from multiprocessing import Pool
 
 LINE_DIVISOR = '----------------------------------------------------'
 
-
-def find_capacity(sizes, iats, verbose=False):
-    """Find an capacity estimate by analyzing inter-arrival times and segment sizes using the PPrate approach."""
-
-    # Exclude null values from input list
-    iats = remove_zeroes(iats)
-
-    # Calculate capacities using our formula
-    if type(sizes) is int:
-        refined_algo = False
-        c = (sizes * 8) / iats
-    elif type(sizes) is list:
-        refined_algo = True
-        c = get_distribution(iats, sizes)
-
-    # Noise cleaning
-    vhi = np.percentile(c, 75, interpolation='midpoint') + 1 * sps.iqr(c)
-    vlo = np.percentile(c, 25, interpolation='midpoint') - 1 * sps.iqr(c)
-    c = remove_zeroes([i for i in c if i <= vhi])
-    c = remove_zeroes([i for i in c if i >= vlo])
+# Statistics of a single find_capacity() call. Times are wall times in seconds,
+# phase2_steps is the number of train lengths tried (0 if Phase 2 was skipped)
+# and unimodal tells whether Phase 1 or Phase 2 ended with a single mode.
+CapacityStats = namedtuple('CapacityStats', [
+    'preprocessing_time', 'phase1_time', 'phase2_time', 'total_time',
+    'res', 'nbin', 'samples', 'phase1_modes', 'phase2_steps', 'unimodal'])
+
+
+def find_capacity(sizes, iats, verbose=False, stats=False):
+    """Find an capacity estimate by analyzing inter-arrival times and segment sizes using the PPrate approach.
+    With stats=True a tuple of the estimate and its CapacityStats is returned."""
+    info = {'preprocessing_time': 0.0, 'phase1_time': 0.0, 'phase2_time': 0.0,
+            'res': None, 'nbin': None, 'samples': 0, 'phase1_modes': 0, 'phase2_steps': 0, 'unimodal': False}
+    start = time.perf_counter()
+
+    def finish(capacity):
+        if not stats:
+            return capacity
+        info['total_time'] = time.perf_counter() - start
+        return capacity, CapacityStats(**info)
+
+    iats, c = capacity_samples(sizes, iats)
+    if np.size(c) == 0:
+        # No usable inter-arrival times, e.g. a flow of a single packet
+        if verbose:
+            print('No capacity samples! Please try again with a different flow capture.')
+        return finish(-1)
 
     # Determine bin width and resolution
-    res = int(np.floor(sps.iqr(np.array(c)) * 0.05))
-    if res != 0:
-        # Suppress division through 0
-        nbin = int(np.ceil(max(c) / res))
-    else:
-        nbin = 1000
-        res = max(c) / nbin
-
-    if nbin > 1000:
-        nbin = 1000
-        res = max(c) / nbin
+    res, nbin = resolution(c)
+    info.update(res=res, nbin=nbin, samples=np.size(c))
+    info['preprocessing_time'] = time.perf_counter() - start
 
     if verbose:
         if res > 10 ** 6:
@@ -52,15 +54,19 @@ def find_capacity(sizes, iats, verbose=False):
 
     modes = np.array([])
 
+    phase_start = time.perf_counter()
     try:
         modes = local_modes(c, nbin, res)
     except ValueError:
         if verbose:
             print('Could not detect modes! Please try again with a different flow capture.')
-        return -1
+        info['phase1_time'] = time.perf_counter() - phase_start
+        return finish(-1)
+    info['phase1_time'] = time.perf_counter() - phase_start
 
     # Get amount of modes
     r = modes.shape[0]
+    info['phase1_modes'] = r
     if r == 1:
         if verbose:
             print('Weak noise')
@@ -69,107 +75,251 @@ def find_capacity(sizes, iats, verbose=False):
         if verbose:
             print('Phase 2: Estimating ADR...')
 
-        step = 3
-        cond = 1
-
-        if refined_algo:
-            # Use default Ethernet MSS as approximation for trains
-            mss = 1460
-        else:
-            # Use MSS from parameter
-            mss = sizes
-
-        while r > 1 and step < 40 and cond:
-            len = int(np.floor(iats.size / step))
-            x = np.reshape(iats[0:(len * step)], (step, len), order='F')
-            x = x[0: step - 1, :]
-            x = np.sum(x, axis=0)
-            b = ((step - 1) * mss * 8) / x
-            modes_2 = local_modes(b, nbin, res)
-            if modes_2.shape[0] == 1:
-                max_mod = np.max(modes_2)
-            else:
-                max_mod = np.max(modes_2[:, 0])
-            if max_mod < 15:
-                cond = 0
-            r = modes_2.shape[0]
-            step += 1
+        phase_start = time.perf_counter()
+        modes_2, info['phase2_steps'] = adr_modes(iats, train_mss(sizes), nbin, res)
+        info['phase2_time'] = time.perf_counter() - phase_start
+        r = modes_2.shape[0]
 
         if r > 1:
             if verbose:
                 print('Phase 2 did not lead to an unimodal distribution!')
                 print('The capacity may be a bad estimate, please try again later.')
-            ind = np.argmax(modes[:, 0])
-            capacity = float(modes[ind, 1] * res - res / 2)
-        else:
+        elif verbose:
             adr = modes_2[0, 1] * res
-
-            if verbose:
-                if flag == 2:
-                    print('ADR estimate: ' + str(adr / 10 ** 6) + ' Mbps')
-                elif flag == 1:
-                    print('ADR estimate: ' + str(adr / 10 ** 3) + ' kbps')
-                else:
-                    print('ADR estimate: ' + str(adr / 10) + ' bps')
-
-            j = (modes[1:, 1] >= modes_2[0, 3]).nonzero()[0]
-            j += 1
-            # modes[1:,1]
-            if np.size(j, 0) == 0:
-                j = (modes[:, 1] <= modes_2[0, 3]).nonzero()[0]
-                capacity = float(modes[j[-1], 1] * res - res / 2)
+            if flag == 2:
+                print('ADR estimate: ' + str(adr / 10 ** 6) + ' Mbps')
+            elif flag == 1:
+                print('ADR estimate: ' + str(adr / 10 ** 3) + ' kbps')
             else:
-                ij = np.argmax(modes[j, 0])
-                capacity = float(modes[j[ij], 1] * res - res / 2)
+                print('ADR estimate: ' + str(adr / 10) + ' bps')
+
+        capacity = select_capacity(modes, modes_2, res)
 
     # Return final estimate value
-    return capacity
+    info['unimodal'] = r == 1
+    return finish(capacity)
 
 
-def local_modes(x, nbin, w):
-    bell = []
+def capacity_samples(sizes, iats):
+    """
+    Turn inter-arrival times into the noise-cleaned sample of capacity estimates
+    :return: inter-arrival times without zeroes and the capacity sample, which is empty if there are no usable inter-arrival times
+    """
+    # Exclude null values from input list
+    iats = remove_zeroes(iats)
+    if np.size(iats) == 0:
+        return iats, np.array([])
+
+    # Calculate capacities using our formula
+    if type(sizes) is int:
+        c = (sizes * 8) / iats
+    elif type(sizes) is list:
+        c = get_distribution(iats, sizes)
 
-    for i in range(1, nbin + 1):
-        bell.append(len([j for j in x if j < i * w]))
+    # Noise cleaning
+    vlo, vhi = noise_bounds(c)
+    c = c[(c <= vhi) & (c >= vlo) & (c != 0)]
+    return iats, c
+
+
+def train_mss(sizes):
+    """Segment size used for the packet trains of Phase 2"""
+    if type(sizes) is list:
+        # Use default Ethernet MSS as approximation for trains
+        return 1460
+    # Use MSS from parameter
+    return sizes
+
+
+def select_capacity(modes, modes_2, res):
+    """
+    Pick the capacity mode of the Phase 1 mode table
+    :param modes: Phase 1 mode table
+    :param modes_2: Phase 2 mode table, None if Phase 2 was skipped
+    :param res: bin width
+    """
+    if modes.shape[0] == 1:
+        return float(modes[0, 1] * res - res / 2)
+
+    if modes_2 is None or modes_2.shape[0] > 1:
+        # Without an unimodal ADR the strongest mode is the best guess
+        ind = np.argmax(modes[:, 0])
+        return float(modes[ind, 1] * res - res / 2)
+
+    # The capacity is the strongest mode above the ADR
+    j = (modes[1:, 1] >= modes_2[0, 3]).nonzero()[0]
+    j += 1
+    if np.size(j, 0) == 0:
+        j = (modes[:, 1] <= modes_2[0, 3]).nonzero()[0]
+        return float(modes[j[-1], 1] * res - res / 2)
+    ij = np.argmax(modes[j, 0])
+    return float(modes[j[ij], 1] * res - res / 2)
+
+
+def bootstrap_interval(sizes, iats, n_boot=200, confidence=0.95, seed=None):
+    """
+    Bootstrap confidence interval of the capacity estimate of a flow.
+    The cleaned capacity sample is resampled n_boot times and all resamples are histogrammed at once.
+    Resamples with several modes pick their capacity mode with the ADR of the original trains (Phase 2),
+    since resampling would destroy the order of the packets within the trains.
+    :param n_boot: number of resamples
+    :param confidence: confidence level of the interval
+    :param seed: seed of the random number generator
+    :return: tuple of lower and upper bound of the interval, NaN if there is no capacity sample
+    """
+    iats, c = capacity_samples(sizes, iats)
+    if np.size(c) == 0:
+        return np.nan, np.nan
+    res, nbin = resolution(c)
+
+    # Resample with replacement, one resample per row
+    rng = np.random.RandomState(seed)
+    resamples = c[rng.randint(0, c.size, (n_boot, c.size))]
+    bells = histograms(resamples, nbin, res)
+
+    modes_2 = None
+    estimates = np.full(n_boot, np.nan)
+    for i, bell in enumerate(bells):
+        try:
+            modes = find_modes(bell)
+        except ValueError:
+            continue
+        if modes.shape[0] > 1 and modes_2 is None:
+            try:
+                modes_2 = adr_modes(iats, train_mss(sizes), nbin, res)[0]
+            except ValueError:
+                return np.nan, np.nan
+        estimates[i] = select_capacity(modes, modes_2, res)
+
+    if np.all(np.isnan(estimates)):
+        return np.nan, np.nan
+    alpha = (1 - confidence) / 2 * 100
+    lower, upper = np.nanpercentile(estimates, [alpha, 100 - alpha])
+    return lower, upper
+
+
+def bootstrap_intervals(sizes, flows, n_boot=200, processes=None, seed=None):
+    """
+    Bootstrap confidence intervals of many independent flows in parallel, see bootstrap_interval()
+    :param sizes: packet sizes of every flow, or one int shared by all flows
+    :param flows: list of inter-arrival time arrays, one per flow
+    :param processes: number of worker processes, defaults to the number of CPU cores. 1 disables the pool
+    :return: arrays of the lower and upper bounds in the order of flows
+    """
+    if type(sizes) is int:
+        sizes = [sizes] * len(flows)
+    n = len(flows)
+    jobs = list(zip(sizes, flows, [n_boot] * n, [0.95] * n, [seed] * n))
+    results = np.array(starmap(bootstrap_interval, jobs, processes), dtype=float).reshape(n, 2)
+    return results[:, 0], results[:, 1]
+
+
+def starmap(function, jobs, processes=None):
+    """
+    Apply function to the argument tuples of jobs, in a pool of worker processes unless processes is 1
+    """
+    if processes == 1 or len(jobs) < 2:
+        return [function(*job) for job in jobs]
+    pool = Pool(processes)
+    try:
+        return pool.starmap(function, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def find_capacities(sizes, flows, processes=None, verbose=False, stats=False):
+    """
+    Estimate the capacities of many independent flows in parallel.
+    :param sizes: packet sizes of every flow (int or list as for find_capacity), or one int shared by all flows
+    :param flows: list of inter-arrival time arrays, one per flow
+    :param processes: number of worker processes, defaults to the number of CPU cores. 1 disables the pool
+    :param stats: additionally return the list of CapacityStats of all flows
+    :return: array of capacity estimates in the order of flows
+    """
+    if type(sizes) is int:
+        sizes = [sizes] * len(flows)
+    n = len(flows)
+    jobs = list(zip(sizes, flows, [verbose] * n, [stats] * n))
+    results = starmap(find_capacity, jobs, processes)
+
+    if not stats:
+        return np.array(results, dtype=float)
+    return np.array([r[0] for r in results], dtype=float), [r[1] for r in results]
+
+
+def adr_modes(iats, mss, nbin, res):
+    """
+    Phase 2: Search for a train length whose average dispersion rate (ADR) distribution is unimodal.
+    :return: mode table of the last train length tried and the number of train lengths tried
+    """
+    # Histogram the ADR samples of all train lengths at once
+    steps = range(3, 40)
+    bells = histograms(train_dispersions(iats, mss, steps), nbin, res)
+
+    for tried, bell in enumerate(bells, 1):
+        modes = find_modes(bell)
+        if modes.shape[0] == 1:
+            max_mod = np.max(modes)
+        else:
+            max_mod = np.max(modes[:, 0])
+        # Stop at the first unimodal ADR or once the modes became too weak
+        if modes.shape[0] == 1 or max_mod < 15:
+            break
+    return modes, tried
 
-    bell = np.append([0, 0], bell)
-    bell = np.diff(bell)
 
-    A = np.diff(bell)
-    # Prepend and append -1
-    A = np.insert(A, 0, -1, 0)
-    A = np.insert(A, A.size, -1, axis=0)
+def noise_bounds(c):
+    """Return the range of capacity samples that are not considered noise"""
+    q1, q3 = np.percentile(c, [25, 75], interpolation='midpoint')
+    iqr = sps.iqr(c)
+    return q1 - 1 * iqr, q3 + 1 * iqr
 
-    # Replace negative and 0 values with -1, positive with 1
-    for i in range(0, A.size):
-        if A[i] <= 0:
-            A[i] = -1
-        else:
-            A[i] = 1
 
-    # Add positive values to peak list if next element is negative
-    peaks = np.array([]).astype(int)
-    for i in (A == 1).nonzero()[0]:
-        if A[i + 1] == -1:
-            peaks = np.append(peaks, i + 1)
+def resolution(c):
+    """Determine the bin width and the number of bins for the capacity samples c"""
+    res = int(np.floor(sps.iqr(c) * 0.05))
+    cmax = np.max(c)
+    if res != 0:
+        # Suppress division through 0
+        nbin = int(np.ceil(cmax / res))
+    else:
+        nbin = 1000
+        res = cmax / nbin
+
+    if nbin > 1000:
+        nbin = 1000
+        res = cmax / nbin
+    return res, nbin
+
+
+def local_modes(x, nbin, w):
+    """Detect the modes of the capacity distribution x using nbin bins of width w"""
+    return find_modes(histogram(x, nbin, w))
+
+
+def find_modes(bell):
+    """Detect the modes of a histogram returned by histogram()"""
+    A = slopes(bell)
+
+    # Peaks are rising slopes followed by a falling or flat one
+    peaks = ((A[:-1] == 1) & (A[1:] == -1)).nonzero()[0] + 1
 
     if peaks.size == 0:
         # Raise exception in case no modes were detected
         raise ValueError
 
-    modes = np.zeros((peaks.size, 3))
-    modes[:, 0] = peaks.conj().transpose()
+    # Split the slope signs into runs of equal values. Every peak sits on the border
+    # between a rising run (its left flank) and a falling run (its right flank).
+    borders = (A[1:] != A[:-1]).nonzero()[0] + 1
+    starts = np.insert(borders, 0, 0)
+    ends = np.append(borders, A.size)
+    run = np.searchsorted(starts, peaks)
 
-    for i, y in enumerate(peaks):
-        index = y
-        while A[index - 2] == 1:
-            index -= 1
-        modes[i, 1] = index
-
-        index = y
-        while (index + 1 <= A.size) and (A[index] == -1):
-            index += 1
-        modes[i, 2] = index
+    modes = np.zeros((peaks.size, 3))
+    modes[:, 0] = peaks
+    modes[:, 1] = starts[run - 1] + 1
+    modes[:, 2] = ends[run]
 
     modes = clean_modes(bell, modes)
     peaks = intersection(peaks, modes[:, 0]).astype(int)
@@ -177,57 +327,92 @@ def local_modes(x, nbin, w):
     return modes
 
 
+def histogram(x, nbin, w):
+    """Count the samples of x per bin of width w, preceded by an empty bin"""
+    return histograms([x], nbin, w)[0]
+
+
+def histograms(samples, nbin, w):
+    """Histogram several samples on the same nbin bins of width w in one pass"""
+    sizes = [np.size(x) for x in samples]
+    x = np.concatenate([np.ravel(x) for x in samples] + [[]])
+    sample = np.repeat(np.arange(len(sizes)), sizes)
+
+    # A value adds to the cumulative count of every upper bin edge above it,
+    # so it is counted in the bin of the first such edge
+    edges = np.arange(1, nbin + 1) * w
+    first = np.searchsorted(edges, x, side='right')
+    counts = np.bincount(sample * (nbin + 1) + first, minlength=len(sizes) * (nbin + 1))
+    counts = counts.reshape(len(sizes), nbin + 1)
+
+    # Drop values beyond the last edge and prepend the empty bin
+    counts[:, 1:] = counts[:, :-1]
+    counts[:, 0] = 0
+    return counts
+
+
+def slopes(bell):
+    """Return the slope signs of the histogram: 1 if rising, -1 if falling or flat"""
+    A = np.where(np.diff(bell) > 0, 1, -1)
+    # Prepend and append -1
+    return np.concatenate(([-1], A, [-1]))
+
+
+def train_dispersions(iats, mss, steps):
+    """Return the ADR samples of packet trains of every length in steps.
+    A train of length step spans step - 1 consecutive gaps, trains do not overlap."""
+    # Train durations are differences of the running sum of gaps
+    t = np.insert(np.cumsum(iats), 0, 0)
+    ret = []
+    for step in steps:
+        start = np.arange(0, int(np.floor(iats.size / step))) * step
+        x = t[start + step - 1] - t[start]
+        ret.append(((step - 1) * mss * 8) / x)
+    return ret
+
+
 def clean_modes(bell, modes):
+    """Drop weak modes and merge neighbouring modes into the dominant ones.
+    The mode table holds one row per mode with the peak, left and right bin."""
     bell = bell.astype(int)
     modes = modes.astype(int)
     thres1 = 0.2
     thres2 = 0.15
 
-    m, id = np.max(bell[modes[:, 0] - 1]), np.argmax(bell[modes[:, 0] - 1])
-
+    # Drop modes far below the highest one
     peaks = bell[modes[:, 0] - 1]
-    alpha = m * thres2
-    li = (peaks < alpha).nonzero()[0]
-
-    for i in range(0, li.size):
-        modes = clean_matrix(li[i], modes)
-        li = li - 1
+    alpha = np.max(peaks) * thres2
+    modes = modes[peaks >= alpha]
 
+    # Merge modes right of the highest one that are not separated by a deep enough valley
     r = np.size(modes, 0)
-    m, id = np.max(bell[modes[:, 0] - 1]), np.argmax(bell[modes[:, 0] - 1])
-
-    for i in range(id, r - 1):
-        a = np.abs(bell[modes[i + 1, 0] - 1] - bell[modes[i, 2] - 1])
-        b = a
-        if (i + 2) < r:
-            b = np.abs(bell[modes[i + 1, 0] - 1] - bell[modes[i + 1, 2] - 1])
-        min_ab = min(a, b)
-        if min_ab <= bell[modes[i + 1, 0] - 1] * thres1:
-            modes[i + 1, 0] = 0
-            sub = modes[id:i + 1, 0].ravel().nonzero()[0]
-            indx = sub[-1] + id
-            modes[indx, 2] = modes[i + 1, 2]
-
-    modes = clean(modes)
-
-    m, id = np.max(bell[modes[:, 0] - 1]), np.argmax(bell[modes[:, 0] - 1])
-    for i in range(id, 0, -1):
-        a = np.abs(bell[modes[i - 1, 0] - 1] - bell[modes[i, 1] - 1])
-        if i - 1 > 0:
-            b = np.abs(bell[modes[i - 1, 0] - 1] - bell[modes[i - 2, 2] - 1])
-        elif bell[modes[i - 1, 0] - 1] != bell[modes[i - 1, 1] - 1]:
-            b = np.abs(bell[modes[i - 1, 0] - 1] - bell[modes[i - 1, 1] - 1])
-        else:
-            b = bell[modes[i - 1, 1] - 1]
-
-        min_ab = min(a, b)
-        if min_ab <= bell[modes[i - 1, 0] - 1] * thres2:
-            modes[i - 1, 0] = 0
-            sub = modes[(i - 1):id + 1, 0].ravel().nonzero()[0]
-            indx = sub[0] + i - 1
-            modes[indx, 1] = modes[i - 1, 1]
-
-    modes = clean(modes)
+    peaks = bell[modes[:, 0] - 1]
+    id = np.argmax(peaks)
+    i = np.arange(id + 1, r)
+    if i.size != 0:
+        a = np.abs(peaks[i] - bell[modes[i - 1, 2] - 1])
+        # The valley behind the last mode is not taken into account
+        right = modes[i, 2]
+        right[-1] = modes[r - 2, 2]
+        b = np.abs(peaks[i] - bell[right - 1])
+        keep = np.ones(r, dtype=bool)
+        keep[i] = np.minimum(a, b) > peaks[i] * thres1
+        modes = clean(modes, keep, 'right')
+
+    # Merge modes left of the highest one in the same way
+    r = np.size(modes, 0)
+    peaks = bell[modes[:, 0] - 1]
+    id = np.argmax(peaks)
+    i = np.arange(0, id)
+    if i.size != 0:
+        a = np.abs(peaks[i] - bell[modes[i + 1, 1] - 1])
+        b = np.abs(peaks[i] - bell[modes[np.maximum(i - 1, 0), 2] - 1])
+        # The first mode is compared to its own left border instead
+        first = bell[modes[0, 1] - 1]
+        b[0] = np.abs(peaks[0] - first) if peaks[0] != first else first
+        keep = np.ones(r, dtype=bool)
+        keep[i] = np.minimum(a, b) > peaks[i] * thres2
+        modes = clean(modes, keep, 'left')
 
     r = np.size(modes, 0)
     if r == 1:
@@ -235,58 +420,135 @@ def clean_modes(bell, modes):
         if modes[0, 2] > l_bell:
             modes[0, 2] = l_bell
 
-        c = float(bell[modes[0, 2] - 1]) / float(bell[modes[0, 0] - 1])
+        # Move the right border to where the distribution falls to 1% of the peak
+        c = bell.astype(float) / float(bell[modes[0, 0] - 1])
 
-        if c > 0.01:
-            while (c > 0.01) & (modes[0, 2] < l_bell):
-                modes[0, 2] = modes[0, 2] + 1
-                c = float(bell[modes[0, 2] - 1]) / float(bell[modes[0, 0] - 1])
+        if c[modes[0, 2] - 1] > 0.01:
+            j = (c[modes[0, 2]:] <= 0.01).nonzero()[0]
+            modes[0, 2] = modes[0, 2] + 1 + j[0] if j.size != 0 else l_bell
         else:
-            while c < 0.01:
-                modes[0, 2] = modes[0, 2] - 1
-                c = float(bell[modes[0, 2] - 1]) / float(bell[modes[0, 0] - 1])
+            j = (c[:modes[0, 2]] >= 0.01).nonzero()[0]
+            modes[0, 2] = j[-1] + 1
 
     return modes
 
 
 def intersection(i1, i2):
-    l1 = np.size(i1, 0)
-    i = []
-
-    for x in range(0, l1):
-        if np.size((i2 == i1[x]).nonzero()[0], 0) == 0:
-            pass
-        else:
-            i = np.append(i, i1[x])
-    return i
-
-
-def clean_matrix(i, matrix):
-    """Delete row i from matrix"""
-    return np.delete(matrix, i, axis=0)
+    """Return the elements of i1 that also occur in i2"""
+    return i1[np.isin(i1, i2)]
 
 
 def remove_zeroes(list):
     """Remove zeroes from array"""
-    return np.array([i for i in list if i != 0])
-
-
-def clean(mode):
-    """Remove leading zero rows from mode matrix"""
-    i = (mode[:, 0] == 0).nonzero()[0]
-    while np.size(i, 0) != 0:
-        mode = clean_matrix(i[0], mode)
-        i = (mode[:, 0] == 0).nonzero()[0]
-    return mode
+    a = np.asarray(list, dtype=float)
+    return a[a != 0]
+
+
+def clean(modes, keep, side):
+    """Remove merged modes from the mode table and widen the modes they were merged into.
+    :param modes: mode table
+    :param keep: boolean mask of the modes that are kept
+    :param side: 'right' if modes were merged into their left neighbour, 'left' otherwise
+    """
+    modes = modes.copy()
+    kept = keep.nonzero()[0]
+    if side == 'right':
+        # A kept mode ends where the last mode merged into it ends
+        nxt = np.append(kept[1:], keep.size)
+        modes[kept, 2] = modes[nxt - 1, 2]
+    else:
+        # A kept mode starts where the first mode merged into it starts
+        prv = np.insert(kept[:-1], 0, -1)
+        modes[kept, 1] = modes[prv + 1, 1]
+    return modes[kept]
 
 
 def get_distribution(iats, sizes):
-    """Calculate capacity estimates"""
-    ret = []
-    for i, x in enumerate(iats):
-        if x == 0 or i == 0:
-            pass
-        else:
-            if sizes[i] == sizes[i - 1]:
-                ret.append((8 * sizes[i]) / x)
-    return ret
+    """Calculate capacity estimates from pairs of equally sized packets"""
+    iats = np.asarray(iats, dtype=float)
+    sizes = np.asarray(sizes[:iats.size])
+    pair = (sizes[1:] == sizes[:-1]) & (iats[1:] != 0)
+    return (8 * sizes[1:][pair]) / iats[1:][pair]
+
+
+class OnlineEstimator(object):
+    """
+    Incremental PPrate estimator for a single flow.
+    Inter-arrival times are fed one by one or in chunks and counted into a running histogram.
+    The bins and the noise range are fixed by the first warmup samples, afterwards every update
+    re-detects the modes (Phase 1) and reports the dominant one as the capacity estimate.
+    The estimate is stable once the dominant mode stayed within tolerance bins while the last
+    max(window, growth * samples) samples were added, i.e. stability is measured in samples and
+    does not depend on how the samples are split into updates.
+    """
+
+    def __init__(self, size, warmup=50, window=100, tolerance=1, growth=0.5):
+        """
+        :param size: packet size in bytes
+        :param warmup: number of samples used to fix the bins before the first estimate
+        :param window: minimal number of samples the dominant mode must stay in place for, also the minimal
+        number of samples after warmup before the estimate can be stable
+        :param tolerance: number of bins the dominant mode may move and still count as in place
+        :param growth: fraction of all samples the dominant mode must stay in place for, if that is more than window
+        """
+        self.size = size
+        self.warmup = warmup
+        self.window = window
+        self.tolerance = tolerance
+        self.growth = growth
+
+        self.samples = np.array([])
+        self.count = 0
+        self.bell = None
+        self.res = None
+        self.nbin = None
+        self.bounds = None
+        # (number of samples, dominant mode) after every update since the binning was fixed
+        self.positions = []
+        self.capacity = -1
+        self.stable = False
+
+    def update(self, iats):
+        """
+        Add inter-arrival times to the running histogram
+        :param iats: a single inter-arrival time or a sequence of them
+        :return: tuple of current capacity estimate (-1 if there is none yet) and stability flag
+        """
+        iats = remove_zeroes(np.atleast_1d(np.asarray(iats, dtype=float)))
+        c = (self.size * 8) / iats
+        self.count += c.size
+
+        if self.bell is None:
+            # Collect samples until the binning can be fixed
+            self.samples = np.append(self.samples, c)
+            if self.samples.size < self.warmup:
+                return self.capacity, self.stable
+            c = self.samples
+            self.samples = None
+            self.bounds = noise_bounds(c)
+            vlo, vhi = self.bounds
+            self.res, self.nbin = resolution(c[(c >= vlo) & (c <= vhi)])
+            self.bell = np.zeros(self.nbin + 1, dtype=int)
+
+        vlo, vhi = self.bounds
+        self.bell += histogram(c[(c >= vlo) & (c <= vhi)], self.nbin, self.res)
+
+        try:
+            modes = find_modes(self.bell)
+        except ValueError:
+            return self.capacity, self.stable
+
+        peak = modes[np.argmax(modes[:, 0]), 1]
+        self.capacity = float(peak * self.res - self.res / 2)
+
+        # Track the dominant mode over the last span samples. The first kept entry is the last one
+        # at or before the start of the span, so the mode is known for the whole span
+        span = max(self.window, int(self.growth * self.count))
+        start = self.count - span
+        self.positions.append((self.count, peak))
+        while len(self.positions) > 1 and self.positions[1][0] <= start:
+            self.positions.pop(0)
+        peaks = [p for n, p in self.positions]
+        self.stable = self.count - self.warmup >= self.window and self.positions[0][0] <= start and \
+            max(peaks) - min(peaks) <= self.tolerance
+        return self.capacity, self.stable
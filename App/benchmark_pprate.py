@@ -0,0 +1,152 @@
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import PPrate as pp
+
+# Capacity of the synthetic bottleneck link in bit/s
+CAPACITY = 50 * 10 ** 6
+# Size of the cross traffic packets in bytes
+CROSS_TRAFFIC_SIZE = 1500
+
+KINDS = ['clean', 'cross_traffic', 'heavy_tail']
+SAMPLES = [100, 300, 1000, 3000, 10000]
+PACKET_SIZES = [100, 500, 1500]
+NBINS = [None, 100, 500, 1000]
+
+# ================= Synthetic distributions ================= #
+def clean_iats(n, size, capacity=CAPACITY, rng=np.random):
+    """
+    Packet pairs that only experienced the bottleneck: one narrow mode at the capacity
+    :param n: number of inter-arrival times
+    :param size: packet size in bytes
+    :param capacity: bottleneck capacity in bit/s
+    """
+    dispersion = (size * 8.0) / capacity
+    return dispersion * (1 + rng.normal(0, 0.02, n))
+
+def cross_traffic_iats(n, size, capacity=CAPACITY, load=0.5, rng=np.random):
+    """
+    Packet pairs interleaved with cross traffic packets, which spreads the dispersion over several modes
+    :param load: mean number of cross traffic packets squeezed between a packet pair
+    """
+    dispersion = (size * 8.0) / capacity
+    cross = rng.poisson(load, n) * (CROSS_TRAFFIC_SIZE * 8.0) / capacity
+    return (dispersion + cross) * (1 + rng.normal(0, 0.02, n))
+
+def heavy_tail_iats(n, size, capacity=CAPACITY, scale=0.2, rng=np.random):
+    """
+    Packet pairs with heavy-tailed (Pareto) queueing noise on top of the bottleneck dispersion
+    :param scale: noise scale relative to the bottleneck dispersion
+    """
+    dispersion = (size * 8.0) / capacity
+    return dispersion * (1 + scale * rng.pareto(1.5, n))
+
+GENERATORS = {
+    'clean': clean_iats,
+    'cross_traffic': cross_traffic_iats,
+    'heavy_tail': heavy_tail_iats,
+}
+
+# ======================= Timing ========================= #
+def best_time(function, repeat, *args):
+    """
+    Run function repeat times and return the fastest wall time together with its result
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def benchmark_phases(size, iats, nbin, repeat):
+    """
+    Time Phase 1 and Phase 2 of PPrate separately
+    :param nbin: number of bins, None to derive it from the data like find_capacity does
+    :return: number of bins, Phase 1 time, number of Phase 1 modes and Phase 2 time (NaN if not needed)
+    """
+    iats, c = pp.capacity_samples(size, iats)
+    res, auto_nbin = pp.resolution(c)
+    if nbin is None:
+        nbin = auto_nbin
+    else:
+        res = max(c) / nbin
+
+    try:
+        phase1, modes = best_time(pp.local_modes, repeat, c, nbin, res)
+    except ValueError:
+        return nbin, np.nan, 0, np.nan
+
+    phase2 = np.nan
+    if modes.shape[0] > 1:
+        try:
+            phase2, (modes_2, steps) = best_time(pp.adr_modes, repeat, iats, size, nbin, res)
+        except ValueError:
+            pass
+    return nbin, phase1, modes.shape[0], phase2
+
+def run(kinds=KINDS, samples=SAMPLES, packet_sizes=PACKET_SIZES, nbins=NBINS, repeat=3, seed=0):
+    """
+    Run the benchmark over all combinations of distribution kind, sample size, packet size and number of bins
+    :return: Pandas DataFrame with one row per combination
+    """
+    rows = []
+    for kind in kinds:
+        for n in samples:
+            for size in packet_sizes:
+                iats = GENERATORS[kind](n, size, rng=np.random.RandomState(seed))
+                total, capacity = best_time(pp.find_capacity, repeat, size, iats)
+                if capacity > 0:
+                    error = abs(capacity - CAPACITY) / CAPACITY * 100
+                else:
+                    error = np.nan
+
+                for nbin in nbins:
+                    used_nbin, phase1, n_modes, phase2 = benchmark_phases(size, iats, nbin, repeat)
+                    rows.append({
+                        'kind': kind,
+                        'samples': n,
+                        'packet_size': size,
+                        'nbin': 'auto' if nbin is None else nbin,
+                        'used_nbin': used_nbin,
+                        'modes': n_modes,
+                        'phase1_ms': phase1 * 1000,
+                        'phase2_ms': phase2 * 1000,
+                        'total_ms': total * 1000,
+                        'estimate_mbps': capacity / 10 ** 6,
+                        'error': error,
+                    })
+    return pd.DataFrame(rows)
+
+def main():
+    """
+    Parse arguments, run the benchmark and print (and optionally store) the results
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the PPrate capacity estimator on synthetic inter-arrival times')
+    parser.add_argument('--kinds', nargs='+', default=KINDS, choices=KINDS, help='distributions to benchmark')
+    parser.add_argument('--samples', nargs='+', type=int, default=SAMPLES, help='numbers of inter-arrival times')
+    parser.add_argument('--sizes', nargs='+', type=int, default=PACKET_SIZES, help='packet sizes in bytes')
+    parser.add_argument('--nbins', nargs='+', type=int, default=None, help='numbers of bins for the phase timings (default: auto, 100, 500, 1000)')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per measurement, the fastest one is reported')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the generators')
+    parser.add_argument('--output', help='store the results in this csv file')
+    args = parser.parse_args()
+
+    nbins = NBINS if args.nbins is None else args.nbins
+
+    # Silence numpy deprecation warnings raised inside PPrate
+    warnings.simplefilter('ignore', DeprecationWarning)
+    results = run(args.kinds, args.samples, args.sizes, nbins, args.repeat, args.seed)
+
+    pd.set_option('display.width', 200)
+    print(results.to_string(index=False, float_format=lambda x: '{:.3f}'.format(x)))
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import PPrate as pp
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# Increase whenever a change to PPrate alters its estimates, so stale entries are never hit
+ESTIMATOR_VERSION = 1
+
+def cache_key(sizes, iats, **params):
+    """
+    Content address of a capacity estimate: hash of the inter-arrival times, the packet sizes and the estimator parameters
+    :param sizes: packet size (int) or list of packet sizes as passed to find_capacity
+    :param iats: inter-arrival times
+    :param params: further estimator parameters that influence the result
+    """
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(iats, dtype=np.float64).tobytes())
+    if type(sizes) is int:
+        h.update('size={}'.format(sizes).encode())
+    else:
+        h.update(b'sizes=')
+        h.update(np.ascontiguousarray(sizes, dtype=np.int64).tobytes())
+    params['version'] = ESTIMATOR_VERSION
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()
+
+class CapacityCache(object):
+    """
+    On-disk memoization of capacity estimates with least-recently-used eviction.
+    Every entry is a small json file named after its key. Entries are written to a temporary
+    file and renamed into place, so several processes can share one cache directory;
+    lookups refresh the modification time which serves as the LRU order.
+    The size bound is checked on the directory itself, when the cache is opened, after every batch of
+    find_capacities and every check_interval insertions, so it holds across short-lived instances and processes.
+    """
+
+    def __init__(self, path=dir_path + '/results/cache', max_entries=100000, check_interval=100):
+        """
+        :param path: cache directory, created if missing
+        :param max_entries: number of entries kept, the least recently used ones are evicted beyond that
+        :param check_interval: number of insertions between two checks of the cache size
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.insertions = 0
+        os.makedirs(path, exist_ok=True)
+        self.evict()
+
+    def entry(self, key):
+        """
+        Path of the file holding key
+        """
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        """
+        Return the cached value of key or None
+        """
+        entry = self.entry(key)
+        try:
+            with open(entry) as f:
+                value = json.load(f)
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError):
+            # Missing, concurrently evicted or unreadable entries are misses
+            return None
+        return value
+
+    def put(self, key, value):
+        """
+        Store value under key
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp, self.entry(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self.insertions += 1
+        if self.insertions % self.check_interval == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until at most max_entries remain
+        """
+        entries = []
+        for e in os.scandir(self.path):
+            if e.name.endswith('.json'):
+                try:
+                    entries.append((e.stat().st_mtime, e.path))
+                except OSError:
+                    continue
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for mtime, entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry)
+            except OSError:
+                # Already evicted by another process
+                pass
+
+    def find_capacity(self, sizes, iats, verbose=False):
+        """
+        Cached version of PPrate.find_capacity
+        """
+        key = cache_key(sizes, iats)
+        capacity = self.get(key)
+        if capacity is None:
+            capacity = pp.find_capacity(sizes, iats, verbose)
+            self.put(key, capacity)
+        return capacity
+
+    def find_capacities(self, sizes, flows, processes=None, verbose=False):
+        """
+        Cached version of PPrate.find_capacities: only flows missing in the cache are estimated
+        """
+        if type(sizes) is int:
+            sizes = [sizes] * len(flows)
+        keys = [cache_key(s, f) for s, f in zip(sizes, flows)]
+        capacities = np.array([self.get(key) for key in keys], dtype=float)
+
+        missing = np.isnan(capacities).nonzero()[0]
+        if missing.size != 0:
+            estimates = pp.find_capacities([sizes[i] for i in missing], [flows[i] for i in missing], processes, verbose)
+            for i, capacity in zip(missing, estimates):
+                capacities[i] = capacity
+                self.put(keys[i], float(capacity))
+            self.evict()
+        return capacities
+
+    def bootstrap_intervals(self, sizes, flows, n_boot=200, processes=None, seed=None):
+        """
+        Cached version of PPrate.bootstrap_intervals: only flows missing in the cache are resampled
+        """
+        if type(sizes) is int:
+            sizes = [sizes] * len(flows)
+        keys = [cache_key(s, f, bootstrap=n_boot, seed=seed) for s, f in zip(sizes, flows)]
+        intervals = [self.get(key) for key in keys]
+
+        missing = [i for i, interval in enumerate(intervals) if interval is None]
+        if missing:
+            lower, upper = pp.bootstrap_intervals([sizes[i] for i in missing], [flows[i] for i in missing],
+                                                  n_boot, processes, seed)
+            for i, lo, up in zip(missing, lower, upper):
+                intervals[i] = [float(lo), float(up)]
+                self.put(keys[i], intervals[i])
+            self.evict()
+        intervals = np.array(intervals, dtype=float).reshape(len(flows), 2)
+        return intervals[:, 0], intervals[:, 1]
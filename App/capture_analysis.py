@@ -0,0 +1,49 @@
+import numpy as np
+from prepare_test import get_packet_size, capture_file
+from pcap_reader import read_pcap, iter_pcap, PACKET_DTYPE
+from process_icmp_csv import FlowGrouper, estimate_streams
+from process_tcp_csv import select_flow, calculate_total_capacity
+
+def read_capture(size, chunk_size=None, filepath=capture_file):
+    """
+    Decode the combined capture once and split it into the hop flows of the ICMP replies and the end-to-end TCP flow
+    :param size: number of routers
+    :param chunk_size: read the capture in chunks of this many bytes, None reads it at once
+    :param filepath: path of the capture, relative to the working directory of the run
+    :return: dictionary mapping every hop to its HopStream and the segments of the TCP flow
+    """
+    if chunk_size is None:
+        chunks = [read_pcap(filepath)]
+    else:
+        f = open(filepath, 'rb')
+        chunks = iter_pcap(f, chunk_size)
+
+    grouper = FlowGrouper()
+    tcp = [np.zeros(0, dtype=PACKET_DTYPE)]
+    try:
+        for packets in chunks:
+            grouper.add(packets)
+            tcp.append(select_flow(packets, size))
+    finally:
+        if chunk_size is not None:
+            f.close()
+
+    streams = {}
+    grouper.fill(streams)
+    return streams, np.concatenate(tcp)
+
+def analyze_capture(size, processes=None, cache=None, chunk_size=None, packet_size=None):
+    """
+    Estimate the hop capacities and the end-to-end capacity from a single decoding pass over the capture
+    :param size: number of routers
+    :param processes: number of processes estimating hops in parallel
+    :param cache: optional CapacityCache that memoizes the hop estimates
+    :param chunk_size: read the capture in chunks of this many bytes, None reads it at once
+    :param packet_size: size of the injected packets, read from the file if None
+    :return: dictionary mapping every hop to its estimated HopStream and the end-to-end capacity in Mbit/s
+    """
+    if packet_size is None:
+        packet_size = get_packet_size()
+    streams, tcp = read_capture(size, chunk_size)
+    estimate_streams(streams, packet_size, processes, cache)
+    return streams, calculate_total_capacity(tcp, {}, size, packet_size)
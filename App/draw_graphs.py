@@ -1,11 +1,13 @@
 import os
 import sys
+import json
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as ns
 import numpy as np
 from numpy.core.fromnumeric import sort
+from results_store import ResultsStore
 
 arg_list = list()
 filename = sys.argv[1]
@@ -27,6 +29,39 @@ def read_args():
 
     return df_list
 
+def read_from_store(store_path, parameter, fixed):
+    """
+    Reads the hop results of a parameter sweep (see sweep.py) and returns one DataFrame per value of the swept parameter
+    together with the values, which serve as legend values
+    :param fixed: values of the other swept parameters the results are restricted to
+    """
+    store = ResultsStore(store_path)
+    results = store.hop_results(parameter, **fixed)
+    store.close()
+    results = results.rename(columns={'capacity': 'estimated'})
+
+    df_list = list()
+    legendvalues = list()
+    for value, df in results.groupby('value', sort=True):
+        df_list.append(df[['path', 'estimated', 'expected', 'error']])
+        legendvalues.append(value)
+
+    return df_list, legendvalues
+
+def parse_fixed(args):
+    """
+    Parses name=value arguments, values are read as json (numbers, lists) or taken as strings
+    """
+    fixed = dict()
+    for arg in args:
+        name, value = arg.split('=', 1)
+        try:
+            fixed[name] = json.loads(value)
+        except ValueError:
+            fixed[name] = value
+
+    return fixed
+
 
 def get_standard_deviation(z):
     standard_deviation = np.std(z)
@@ -95,8 +130,9 @@ def plot_error_rate(x, z):
     plt.grid()
     plt.show()
 
-def plot_multiple_error(legend, legendvalues):
-    df_list = read_args()
+def plot_multiple_error(legend, legendvalues, df_list=None):
+    if df_list is None:
+        df_list = read_args()
     xx = list()
     zz = list()
     
@@ -122,8 +158,9 @@ def plot_multiple_error(legend, legendvalues):
     plt.grid()
     plt.show()
 
-def plot_multiple_lines(legend, legendvalues):
-    df_list = read_args()
+def plot_multiple_lines(legend, legendvalues, df_list=None):
+    if df_list is None:
+        df_list = read_args()
     
     sizes = [3, 8, 20, 32, 63]
 
@@ -183,7 +220,13 @@ err_legend = "RE(%); Packet Size: {} bytes"
 # err_legend = "RE(%); icmp_ratelimit={}"
 
 
-if len(sys.argv) > 2:
+if filename.endswith('.db'):
+    # Sweep results: draw_graphs.py results/sweep_config/sweep.db packet_size [topo_size=8 ...]
+    parameter = sys.argv[2]
+    df_list, legendvalues = read_from_store(filename, parameter, parse_fixed(sys.argv[3:]))
+    plot_multiple_lines("Estimated Capacity; " + parameter + ": {}", legendvalues, df_list)
+    plot_multiple_error("RE(%); " + parameter + ": {}", legendvalues, df_list)
+elif len(sys.argv) > 2:
     plot_multiple_lines(plot_legend, legendvalues)
     plot_multiple_error(err_legend, legendvalues)
 else:
@@ -0,0 +1,184 @@
+import os
+import mmap
+import argparse
+import tempfile
+import numpy as np
+from pcap_reader import read_header, record_offsets, decode, ip_to_int, ip_to_str, PACKET_DTYPE
+from process_icmp_csv import FlowGrouper, estimate_streams, hop_flow
+
+# One row per (src, dst) flow: its packets are offsets[start:start + count]
+FLOW_DTYPE = np.dtype([
+    ('src', np.uint32),
+    ('dst', np.uint32),
+    ('start', np.int64),
+    ('count', np.int64),
+])
+
+# Increase whenever the layout of the index file changes
+INDEX_VERSION = 1
+
+def index_path(pcap_path):
+    """
+    Path of the sidecar index of a capture
+    """
+    return pcap_path + '.idx.npz'
+
+def open_pcap(pcap_path):
+    """
+    Memory-map a pcap capture
+    :return: mmap object, None for an empty file
+    """
+    with open(pcap_path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def build_index(pcap_path):
+    """
+    Scan a capture once and store the record offsets of every (src, dst) flow in a sidecar file
+    :param pcap_path: path of the .pcap file
+    :return: the index, as returned by load_index()
+    """
+    buf = open_pcap(pcap_path)
+    if buf is None:
+        header = (b'<', 10 ** 6, 0)
+        packets, offsets = np.zeros(0, dtype=PACKET_DTYPE), np.zeros(0, dtype=np.int64)
+    else:
+        try:
+            endian, divisor, linktype = read_header(buf)
+            header = (endian.encode(), divisor, linktype)
+            packets, offsets = decode(buf, record_offsets(buf, endian)[0], endian, divisor, linktype, return_offsets=True)
+        finally:
+            buf.close()
+
+    # Stable sort by flow keeps the capture order within every flow
+    order = np.lexsort((packets['dst'], packets['src']))
+    src = packets['src'][order]
+    dst = packets['dst'][order]
+    starts = np.flatnonzero(np.diff(src.astype(np.int64)) | np.diff(dst.astype(np.int64))) + 1
+    starts = np.insert(starts, 0, 0) if src.size else starts
+
+    flows = np.zeros(starts.size, dtype=FLOW_DTYPE)
+    flows['src'] = src[starts]
+    flows['dst'] = dst[starts]
+    flows['start'] = starts
+    flows['count'] = np.diff(np.append(starts, src.size))
+
+    stat = os.stat(pcap_path)
+    index = {
+        'version': np.int64(INDEX_VERSION),
+        'pcap_size': np.int64(stat.st_size),
+        'pcap_mtime': np.int64(stat.st_mtime_ns),
+        'endian': np.bytes_(header[0]),
+        'divisor': np.int64(header[1]),
+        'linktype': np.int64(header[2]),
+        'flows': flows,
+        'offsets': offsets[order],
+    }
+
+    # Write to a temporary file and rename it into place, so readers never see a partial index
+    path = index_path(pcap_path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return index
+
+def load_index(pcap_path, rebuild=True):
+    """
+    Load the sidecar index of a capture
+    :param pcap_path: path of the .pcap file
+    :param rebuild: build the index if it is missing or older than the capture
+    :return: dict with the pcap header fields, the flow table (FLOW_DTYPE) and the record offsets sorted by flow
+    """
+    path = index_path(pcap_path)
+    if os.path.exists(path):
+        with np.load(path) as f:
+            index = {name: f[name] for name in f.files}
+        stat = os.stat(pcap_path)
+        if index['version'] == INDEX_VERSION and index['pcap_size'] == stat.st_size and \
+                index['pcap_mtime'] == stat.st_mtime_ns:
+            return index
+    if not rebuild:
+        raise IOError('No up-to-date index for {}'.format(pcap_path))
+    return build_index(pcap_path)
+
+def list_flows(pcap_path):
+    """
+    List the flows of an indexed capture
+    :return: list of (source IP, destination IP, number of packets) tuples
+    """
+    flows = load_index(pcap_path)['flows']
+    names = ip_to_str(np.concatenate((flows['src'], flows['dst'])))
+    return [(names[i], names[i + flows.size], int(flows['count'][i])) for i in range(flows.size)]
+
+def read_flows(pcap_path, flows):
+    """
+    Memory-map a capture and decode only the packets of the given flows
+    :param pcap_path: path of the .pcap file
+    :param flows: list of (source IP, destination IP) pairs as dotted-quad strings
+    :return: structured array of PACKET_DTYPE in capture order
+    """
+    index = load_index(pcap_path)
+    table = index['flows']
+    selected = []
+    for src, dst in flows:
+        match = np.flatnonzero((table['src'] == ip_to_int(src)) & (table['dst'] == ip_to_int(dst)))
+        for i in match:
+            selected.append(index['offsets'][table['start'][i]:table['start'][i] + table['count'][i]])
+    if not selected:
+        return np.zeros(0, dtype=PACKET_DTYPE)
+
+    # Restore the capture order across the selected flows
+    offsets = np.sort(np.concatenate(selected))
+    buf = open_pcap(pcap_path)
+    try:
+        endian = index['endian'].item().decode()
+        return decode(buf, offsets, endian, int(index['divisor']), int(index['linktype']))
+    finally:
+        buf.close()
+
+def estimate_hops(pcap_path, hops, packet_size, processes=None, cache=None):
+    """
+    Estimate the capacity of selected hops of an archived ICMP capture without decoding the other hops
+    :param pcap_path: path of the archived capture
+    :param hops: hop positions, starting at 1
+    :param packet_size: size of the injected packets in bytes
+    :param processes: number of processes estimating hops in parallel
+    :param cache: optional CapacityCache that memoizes the estimates
+    :return: streams dictionary like process_icmp_csv.calculate_capacities()
+    """
+    grouper = FlowGrouper()
+    grouper.add(read_flows(pcap_path, [hop_flow(hop) for hop in hops]))
+    streams = {}
+    grouper.fill(streams)
+    return estimate_streams(streams, packet_size, processes, cache)
+
+def main():
+    """
+    Build (or refresh) the flow indexes of archived captures and list their flows
+    """
+    parser = argparse.ArgumentParser(description='Build per-flow offset indexes of pcap captures')
+    parser.add_argument('captures', nargs='+', help='pcap files to index')
+    parser.add_argument('--force', action='store_true', help='rebuild indexes that are up to date')
+    parser.add_argument('--list', action='store_true', help='print the flows of every capture')
+    args = parser.parse_args()
+
+    for pcap_path in args.captures:
+        if args.force:
+            build_index(pcap_path)
+        if args.list:
+            print(pcap_path)
+            for src, dst, count in list_flows(pcap_path):
+                print("    ({}, {}) -> {} packets".format(src, dst, count))
+        else:
+            load_index(pcap_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import numpy as np
+from collections import namedtuple
+from pcap_reader import ns_to_seconds
+
+# Outcome of a hop: estimated and expected capacity in Mbit/s, the relative error in percent and the
+# bounds of the bootstrap 95% confidence interval of the estimate in Mbit/s.
+# expected and error stay None until the estimate is compared to the assigned capacities,
+# lower and upper stay None unless bootstrap resampling is enabled
+HopResult = namedtuple('HopResult', ['capacity', 'expected', 'error', 'lower', 'upper'], defaults=(None, None))
+
+class HopStream(object):
+    """
+    Packet data of a single hop (the ICMP replies of one router) in typed columns: capture times and
+    filtered inter-arrival times as int64 nanoseconds and IP sizes as uint16, i.e. 18 bytes per packet
+    """
+    __slots__ = ('key', 'src', 'dst', 'ts', 'iats', 'ip_len', 'result', 'stats')
+
+    def __init__(self, key, src, dst, ts, iats, ip_len):
+        """
+        :param key: printable "(source, destination)" name of the hop
+        :param src: source IP address of the replies (integer)
+        :param dst: destination IP address of the replies (integer)
+        :param ts: capture times of the replies in nanoseconds since the epoch
+        :param iats: inter-arrival times in nanoseconds
+        :param ip_len: IP sizes of the replies
+        """
+        self.key = key
+        self.src = src
+        self.dst = dst
+        self.ts = np.ascontiguousarray(ts, dtype=np.int64)
+        self.iats = np.ascontiguousarray(iats, dtype=np.int64)
+        self.ip_len = np.ascontiguousarray(ip_len, dtype=np.uint16)
+        self.result = None
+        # HopStats of the replies, see loss_stats.hop_statistics()
+        self.stats = None
+
+    def iats_seconds(self):
+        """
+        Inter-arrival times as float seconds, as expected by PPrate
+        """
+        return ns_to_seconds(self.iats)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the packet columns
+        """
+        return self.ts.nbytes + self.iats.nbytes + self.ip_len.nbytes
+
+    def __repr__(self):
+        return 'HopStream({}, packets={}, result={})'.format(self.key, self.ip_len.size, self.result)
@@ -0,0 +1,120 @@
+import threading
+import numpy as np
+import PPrate as pp
+from pcap_reader import iter_pcap, ns_to_seconds, IPPROTO_TCP, PACKET_DTYPE
+from process_icmp_csv import FlowGrouper, estimate_streams, bit_to_mbit
+
+class TeeReader(object):
+    """
+    Binary stream wrapper that copies everything read from the stream to an archive file
+    """
+
+    def __init__(self, stream, archive):
+        """
+        :param stream: binary file object to read from, e.g. the stdout pipe of tcpdump
+        :param archive: binary file object receiving a copy of the data, None keeps no copy
+        """
+        self.stream = stream
+        self.archive = archive
+
+    def copy(self, data):
+        if self.archive is not None:
+            self.archive.write(data)
+        return data
+
+    def read(self, n=-1):
+        return self.copy(self.stream.read(n))
+
+    def read1(self, n=-1):
+        return self.copy(self.stream.read1(n))
+
+class LiveCapture(threading.Thread):
+    """
+    Decode the capture while it is running and feed the ICMP replies to per-hop estimators.
+    tcpdump writes the capture to a pipe (-U -w -), this thread decodes it incrementally,
+    groups the replies into hop flows and updates one OnlineEstimator per hop.
+    TCP segments are kept for the end-to-end estimate. The raw capture is still archived,
+    so the pcap can be analysed again later.
+    """
+
+    def __init__(self, stream, packet_size, archive=None, chunk_size=2 ** 16):
+        """
+        :param stream: binary file object delivering the pcap capture
+        :param packet_size: size of the injected packets in bytes
+        :param archive: path the raw capture is copied to, None keeps no copy
+        :param chunk_size: maximal number of bytes decoded at a time
+        """
+        super(LiveCapture, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.packet_size = packet_size
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.grouper = FlowGrouper()
+        self.estimators = {}
+        self.converged = set()
+        # Number of decoded packets, grows while the capture is running
+        self.received = 0
+        self.tcp = []
+        self.error = None
+
+    def run(self):
+        archive = open(self.archive, 'wb') if self.archive else None
+        try:
+            for packets in iter_pcap(TeeReader(self.stream, archive), self.chunk_size):
+                self.received += packets.size
+                self.tcp.append(packets[packets['proto'] == IPPROTO_TCP])
+                for key, iats in self.grouper.add(packets):
+                    if key not in self.estimators:
+                        self.estimators[key] = pp.OnlineEstimator(self.packet_size)
+                    if iats.size == 0:
+                        continue
+                    capacity, stable = self.estimators[key].update(ns_to_seconds(iats))
+                    if stable and key not in self.converged:
+                        self.converged.add(key)
+                        print("hop {} converged at {}mbps".format(key, bit_to_mbit(capacity)))
+        except BaseException as e:
+            self.error = e
+        finally:
+            if archive is not None:
+                archive.close()
+
+    def estimates(self):
+        """
+        Current online estimates
+        :return: dictionary mapping every hop to its capacity estimate in Mbit/s (-1 if there is none yet) and stability flag
+        """
+        return {key: (bit_to_mbit(e.capacity) if e.capacity > 0 else -1, e.stable) for key, e in self.estimators.items()}
+
+    def tcp_packets(self):
+        """
+        TCP segments captured so far
+        :return: structured array of PACKET_DTYPE in capture order
+        """
+        return np.concatenate(self.tcp + [np.zeros(0, dtype=PACKET_DTYPE)])
+
+    def results(self, processes=None, cache=None, timeout=None):
+        """
+        Wait until the capture ends and run the full PPrate estimation on the grouped hops.
+        The final estimates come from the full estimation, the live estimates are reported next to them
+        :param processes: number of processes estimating hops in parallel
+        :param cache: optional CapacityCache that memoizes the estimates
+        :param timeout: seconds to wait for the end of the capture, None waits forever
+        :return: streams dictionary like process_icmp_csv.calculate_capacities()
+        """
+        self.join(timeout)
+        if self.is_alive():
+            raise RuntimeError('Live capture did not end')
+        if self.error is not None:
+            raise self.error
+
+        streams = {}
+        self.grouper.fill(streams)
+        estimate_streams(streams, self.packet_size, processes, cache)
+        live = self.estimates()
+        for key in streams:
+            if key in live:
+                capacity, stable = live[key]
+                print("hop {} live estimate {}mbps ({}), full estimate {}mbps".format(
+                    key, capacity, 'converged' if stable else 'not converged', streams[key].result.capacity))
+        return streams
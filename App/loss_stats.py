@@ -0,0 +1,71 @@
+import numpy as np
+from collections import namedtuple
+
+# Reply statistics of a hop. loss is in percent, the gap values are inter-arrival times in milliseconds.
+# reordered counts replies that arrived after the replies of the next hop (with replies) had started,
+# gaps counts inter-arrival times longer than gap_factor times the median one (e.g. ICMP rate limiting)
+HopStats = namedtuple('HopStats', ['received', 'sent', 'loss', 'reordered', 'gaps', 'gap_median', 'gap_p95', 'gap_max'])
+
+def quantiles(values, starts, counts, q):
+    """
+    Linearly interpolated quantile of every group of a group-wise sorted array (like np.percentile)
+    :param values: values sorted within every group, groups stored one after another
+    :param starts: index of the first value of every group
+    :param counts: number of values of every group, groups without values yield NaN
+    :param q: quantile in [0, 1]
+    """
+    result = np.full(counts.size, np.nan)
+    has = counts > 0
+    pos = q * (counts[has] - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    frac = pos - lo
+    result[has] = values[starts[has] + lo] * (1 - frac) + values[starts[has] + hi] * frac
+    return result
+
+def hop_statistics(streams, sent, gap_factor=10):
+    """
+    Compute the loss, reordering and gap statistics of all hops at once and store them as HopStats of the hops
+    :param streams: dictionary mapping every hop to its HopStream, in hop order
+    :param sent: number of probes sent towards every hop
+    :param gap_factor: inter-arrival times longer than gap_factor times the median one count as gaps
+    :return: dictionary mapping every hop to its HopStats
+    """
+    keys = list(streams)
+    if not keys:
+        return {}
+    counts = np.array([streams[key].ts.size for key in keys], dtype=np.int64)
+    ts = np.concatenate([streams[key].ts for key in keys])
+    hop = np.repeat(np.arange(len(keys)), counts)
+    starts = np.cumsum(counts) - counts
+
+    # Raw inter-arrival times within every hop, sorted per hop
+    same = hop[1:] == hop[:-1]
+    iats = np.diff(ts)[same]
+    iat_hop = hop[1:][same]
+    order = np.lexsort((iats, iat_hop))
+    sorted_iats = iats[order]
+    n_iats = np.maximum(counts - 1, 0)
+    iat_starts = np.cumsum(n_iats) - n_iats
+
+    median = quantiles(sorted_iats, iat_starts, n_iats, 0.5)
+    p95 = quantiles(sorted_iats, iat_starts, n_iats, 0.95)
+    maximum = quantiles(sorted_iats, iat_starts, n_iats, 1.0)
+    gaps = np.bincount(iat_hop[iats > gap_factor * median[iat_hop]], minlength=len(keys))
+
+    # Probes are sent hop after hop, replies after the first reply of the next hop are out of order.
+    # Hops without replies have no first reply, the next hop with replies is taken instead
+    has = counts > 0
+    first = np.append(ts[starts[has]], np.iinfo(np.int64).max)
+    # Rank of every hop among the hops with replies, hops after the last one map to the sentinel
+    following = np.cumsum(has)
+    next_first = first[np.minimum(following, has.sum())]
+    reordered = np.bincount(hop[ts > next_first[hop]], minlength=len(keys))
+
+    loss = np.maximum(0, 1 - counts / float(sent)) * 100
+    stats = {}
+    for i, key in enumerate(keys):
+        stats[key] = HopStats(int(counts[i]), sent, round(float(loss[i]), 2), int(reordered[i]), int(gaps[i]),
+                              median[i] / 10 ** 6, p95[i] / 10 ** 6, maximum[i] / 10 ** 6)
+        streams[key].stats = stats[key]
+    return stats
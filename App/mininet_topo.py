@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import os
-import time
+import re
+import tempfile
 from mininet.link import TCLink
 from mininet.node import Node
 from mininet.topo import Topo
@@ -9,12 +10,16 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel, info
 from mininet.clean import cleanup
 from prepare_test import generate_capacities
-from subprocess import PIPE, STDOUT
-from prepare_test import set_packet_size
-from process_icmp_csv import get_assigned_capacities
+from subprocess import PIPE, STDOUT, DEVNULL
+from prepare_test import set_packet_size, get_packet_size, capture_file
+from live_capture import LiveCapture
+from readiness import wait_for_output, wait_until, wait_until_idle, wait_for_exit
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# Default port of the iperf servers generating cross traffic
+IPERF_PORT = 5001
+
 def rp_disable(host):
     """
     Disable Reverse Path Filtering 
@@ -38,6 +43,30 @@ class LinuxRouter( Node ):
         self.cmd( 'sysctl net.ipv4.ip_forward=0' )
         super( LinuxRouter, self ).terminate()
 
+def run_batch(node, tool, commands):
+    """
+    Apply iproute2 commands on a node with a single batch invocation instead of one shell round-trip per command
+    :param node: target node
+    :param tool: 'ip' or 'tc'
+    :param commands: commands without the leading tool name, e.g. 'route add to 10.0.1.0/24 via 10.0.0.1'
+    :return: output of the tool
+    """
+    if not commands:
+        return ''
+    with tempfile.NamedTemporaryFile('w', prefix='{}-{}-'.format(node.name, tool), suffix='.batch', delete=False) as f:
+        f.write('\n'.join(commands) + '\n')
+    try:
+        # -force keeps going after a failing command, like separate invocations did
+        return node.cmd('{} -force -batch {}'.format(tool, f.name))
+    finally:
+        os.remove(f.name)
+
+def address_commands(intf, address):
+    """
+    ip commands replacing the address of an interface (like ifconfig intf address)
+    """
+    return ['addr flush dev {}'.format(intf), 'addr add {} dev {}'.format(address, intf), 'link set dev {} up'.format(intf)]
+
 # ================= Build and configure ================= #
 def build_topo(size=1):
     """
@@ -79,10 +108,9 @@ def configure_routers(net, **test_parameters):
     # test parameters
     size = test_parameters['topo_size']
     icmp_ratelimit = test_parameters['icmp_ratelimit']
-    packet_loss = test_parameters['packet_loss']
     # command to configure all Routes
-    config_routes_right = "ip route add to 10.0.{}.0/24 via 10.0.{}.{}"
-    config_routes_left = "ip route add to 10.0.{}.0/24 via 10.0.{}.{}"
+    config_routes_right = "route add to 10.0.{}.0/24 via 10.0.{}.{}"
+    config_routes_left = "route add to 10.0.{}.0/24 via 10.0.{}.{}"
     host_part_eth0 = 2
     host_part_eth1 = 1 
 
@@ -90,30 +118,30 @@ def configure_routers(net, **test_parameters):
         router = net.get('r{}'.format(i))
 
         # configure router interfaces
-        router.cmd("ifconfig r{}-eth0 10.0.{}.2/24".format(i, i-1)) # left
-        router.cmd("ifconfig r{}-eth1 10.0.{}.1/24".format(i, i))   # right
-        router.cmd("ifconfig r{}-eth2 10.1.{}.3/24".format(i, i))   # north 
-        router.cmd("ifconfig r{}-eth3 10.2.{}.4/24".format(i, i))   # south
+        commands = []
+        commands += address_commands('r{}-eth0'.format(i), '10.0.{}.2/24'.format(i-1)) # left
+        commands += address_commands('r{}-eth1'.format(i), '10.0.{}.1/24'.format(i))   # right
+        commands += address_commands('r{}-eth2'.format(i), '10.1.{}.3/24'.format(i))   # north
+        commands += address_commands('r{}-eth3'.format(i), '10.2.{}.4/24'.format(i))   # south
 
         # to the right hosts
         for j in range(i+1, size+1):
             # right routers
-            router.cmd(config_routes_right.format(j, i, host_part_eth0))
+            commands.append(config_routes_right.format(j, i, host_part_eth0))
             # top and bottom hosts on the right
-            router.cmd('ip route add to 10.1.{}.0/24 via 10.0.{}.2'.format(j, i))
-            router.cmd('ip route add to 10.2.{}.0/24 via 10.0.{}.2'.format(j, i))
+            commands.append('route add to 10.1.{}.0/24 via 10.0.{}.2'.format(j, i))
+            commands.append('route add to 10.2.{}.0/24 via 10.0.{}.2'.format(j, i))
         
         # to the left hosts
         for j in range(0, i):
             # left routers
-            router.cmd(config_routes_left.format(j, i-1, host_part_eth1))
+            commands.append(config_routes_left.format(j, i-1, host_part_eth1))
             # top and bottom hosts on the left
-            router.cmd('ip route add to 10.1.{}.0/24 via 10.0.{}.1'.format(j+1, i-1))
-            router.cmd('ip route add to 10.2.{}.0/24 via 10.0.{}.1'.format(j+1, i-1))
+            commands.append('route add to 10.1.{}.0/24 via 10.0.{}.1'.format(j+1, i-1))
+            commands.append('route add to 10.2.{}.0/24 via 10.0.{}.1'.format(j+1, i-1))
 
+        run_batch(router, 'ip', commands)
         configure_icmp_ratelimit(router, icmp_ratelimit)
-        if(packet_loss > 0):
-            apply_packet_loss(router, packet_loss)
 
 def configure_cross_hosts(net, size):
     """
@@ -125,19 +153,20 @@ def configure_cross_hosts(net, size):
     for i in range(1, size+1):
         topHost = net.get('t{}'.format(i))
         topHost.setIP('10.1.{}.20'.format(i), intf='t{}-eth0'.format(i))
-        topHost.cmd("ifconfig t{}-eth0 10.1.{}.20/24".format(i, i))
-        topHost.cmd('ip route add default via 10.1.{}.3'.format(i))
+        run_batch(topHost, 'ip', address_commands('t{}-eth0'.format(i), '10.1.{}.20/24'.format(i)) +
+                  ['route add default via 10.1.{}.3'.format(i)])
 
         bottomHost = net.get('b{}'.format(i))
         bottomHost.setIP('10.2.{}.40'.format(i), intf='b{}-eth0'.format(i))
-        bottomHost.cmd("ifconfig b{}-eth0 10.2.{}.40/24".format(i, i))
-        bottomHost.cmd('ip route add default via 10.2.{}.4'.format(i))
+        run_batch(bottomHost, 'ip', address_commands('b{}-eth0'.format(i), '10.2.{}.40/24'.format(i)) +
+                  ['route add default via 10.2.{}.4'.format(i)])
 
 def configure_net(net, size, **test_parameters):
     """
     Configure mininet network
     :param net: network object
     :param size: number of routers
+    :return: list of the link capacities applied to the path
     """
     size = test_parameters['topo_size']
     capacity_range = test_parameters['capacity_range']
@@ -147,20 +176,18 @@ def configure_net(net, size, **test_parameters):
 
     h1 = net.get('h1')
     h1.setIP('10.0.0.10', intf='h1-eth0')
-    h1.cmd("ifconfig h1-eth0 10.0.0.10/24")
-    h1.cmd("route add default gw 10.0.0.2 dev h1-eth0")
+    run_batch(h1, 'ip', address_commands('h1-eth0', '10.0.0.10/24') + ['route add default via 10.0.0.2 dev h1-eth0'])
 
     configure_routers(net, **test_parameters)
     configure_cross_hosts(net, size)
 
     h2 = net.get('h2')
     h2.setIP('10.0.{}.10'.format(size), intf='h2-eth0')
-    h2.cmd("ifconfig h2-eth0 10.0.{}.10/24".format(size))
-    h2.cmd("route add default gw 10.0.{}.1".format(size))
+    run_batch(h2, 'ip', address_commands('h2-eth0', '10.0.{}.10/24'.format(size)) + ['route add default via 10.0.{}.1'.format(size)])
 
     capacities = generate_capacities(a, b, size+1, capacity_delta)
     print(capacities)
-    set_capacities(net, size, capacities)
+    set_capacities(net, size, capacities, packet_loss=test_parameters['packet_loss'])
 
     # do I actually need this???
     h1.cmd('tc qdisc replace dev leftHost-eth0 root fq pacing')
@@ -168,31 +195,38 @@ def configure_net(net, size, **test_parameters):
     h2.cmd('tc qdisc replace dev rightHost-eth0 root netem delay 50')
 
     # save_capacities_to_file(capacities)
+    return capacities
 
-def set_capacities(net, n_routers, capacities):
+def set_capacities(net, n_routers, capacities, action='add', packet_loss=0):
     """
-    Set link capacities by applying traffic limiters throughout the path
+    Set link capacities by applying traffic limiters throughout the path, with one tc batch per node
     :param n_routers: Amount of routers on the path
     :param capacities: list of link capacities
     :param net: Mininet network object
+    :param action: tc action, 'add' for a new network and 'change' to update the rates of the existing
+    limiters in place, which keeps their netem children (packet loss)
+    :param packet_loss: percentage of packets the routers drop, applied below the new limiters when adding them
     """
     # Get left and rigth Host
     h1 = net.get("h1")
     h2 = net.get("h2")
 
     # Apply traffic limiters to first and last link
-    h1.cmd("tc qdisc add dev h1-eth0 root handle 1: tbf latency 100ms buffer 2000b rate {}mbit".format(capacities[0]))
-    h2.cmd("tc qdisc add dev h2-eth0 root handle 1: tbf latency 100ms buffer 2000b rate {}mbit".format(capacities[-1]))
+    run_batch(h1, 'tc', ["qdisc {} dev h1-eth0 root handle 1: tbf latency 100ms buffer 2000b rate {}mbit".format(action, capacities[0])])
+    run_batch(h2, 'tc', ["qdisc {} dev h2-eth0 root handle 1: tbf latency 100ms buffer 2000b rate {}mbit".format(action, capacities[-1])])
 
-    set_capacity = "tc qdisc add dev r{}-eth{} root handle 1: tbf latency 100ms buffer 2000b rate {}mbit"
+    set_capacity = "qdisc " + action + " dev r{}-eth{} root handle 1: tbf latency 100ms buffer 2000b rate {}mbit"
 
     for i in range(n_routers):
         # Apply traffic limiter at router i
         router = net.get("r{}".format(i+1))
 
         # limit eth0 and eth1 respectively
-        router.cmd(set_capacity.format(i+1, 0, capacities[i]))
-        router.cmd(set_capacity.format(i+1, 1, capacities[i + 1]))
+        commands = [set_capacity.format(i+1, 0, capacities[i]), set_capacity.format(i+1, 1, capacities[i + 1])]
+        # netem attaches to the class of the limiter, so it has to follow it
+        if action == 'add' and packet_loss > 0:
+            commands += packet_loss_commands(router, packet_loss)
+        run_batch(router, 'tc', commands)
 
         # # loss on left interface
         # router.cmd("tc qdisc add dev r{}-eth0 parent 1:1 handle 10: netem limit 1000 loss {}%".format(i, 10))
@@ -213,26 +247,34 @@ def configure_icmp_ratelimit(router, rate_limit=1000):
     else:
         router.cmd(disable_icmp_ratemask)
 
+def packet_loss_commands(host, packet_loss):
+    """
+    tc commands applying artificial packet loss to routers, below the traffic limiters of set_capacities()
+    :param host: target host
+    :param packet_loss: percentage of packets to be lost 
+    """
+    apply_packet_loss = "qdisc add dev {}-eth{} parent 1:1 handle 10: netem limit 10000 loss {}%"
+    return [apply_packet_loss.format(host, 0, packet_loss), apply_packet_loss.format(host, 1, packet_loss)]
+
 def apply_packet_loss(host, packet_loss):
     """
     Apply artificial packet loss to routers
     :param host: target host
     :param packet_loss: percentage of packets to be lost 
     """
-    apply_packet_loss = "tc qdisc add dev {}-eth{} parent 1:1 handle 10: netem limit 10000 loss {}%"
-    host.cmd(apply_packet_loss.format(host, 0, packet_loss))
-    host.cmd(apply_packet_loss.format(host, 1, packet_loss))
+    run_batch(host, 'tc', packet_loss_commands(host, packet_loss))
 
 # ========================= Run ========================= #
-def cross_traffic(net, ct, duration=10, router_count=3):
+def cross_traffic(net, ct, capacities, duration=10, router_count=3):
     """
     Apply cross traffic to the network
     :param net: network instance
     :param ct: cross traffic load
+    :param capacities: list of the link capacities of the path
     :param duration: experiment duration
     :param router_count: number of routers
+    :return: the iperf processes, to be stopped with stop_processes() once the measurement is done
     """
-    capacities = get_assigned_capacities()
     topHost = net.get("t1")
     bottomHost = net.get("b2")
     
@@ -252,73 +294,218 @@ def cross_traffic(net, ct, duration=10, router_count=3):
     t1 = net.get("t1")
     b2 = net.get("b2")
 
-    t1.cmd("tcpdump -n -w top_bottom_hosts/tophost.pcap &")
-    b2.cmd("tcpdump -n -w top_bottom_hosts/bottomhost.pcap &")
+    # Own processes instead of pkill, which would also stop the captures of concurrent runs
+    top_dump = start_capture(t1, "tcpdump -n -U --time-stamp-precision=nano -w top_bottom_hosts/tophost.pcap")
+    bottom_dump = start_capture(b2, "tcpdump -n -U --time-stamp-precision=nano -w top_bottom_hosts/bottomhost.pcap")
     t1.cmd("tcpdump -A -r top_bottom_hosts/tophost.pcap > top_bottom_hosts/tophost.txt &")
     b2.cmd("tcpdump -A -r top_bottom_hosts/bottomhost.pcap > top_bottom_hosts/bottomhost.txt &")
     
-    time.sleep(5)
-    for i in range(2, router_count+1):
-        bottomHost = net.get("b{}".format(i))
-        cmd = cmd_bottom.format(duration + 2, i)
-        bottomHost.popen(cmd, stdout=PIPE, stderr=PIPE)
+    iperfs = []
+    try:
+        for i in range(2, router_count+1):
+            bottomHost = net.get("b{}".format(i))
+            cmd = cmd_bottom.format(duration + 2, i)
+            # iperf only writes to its pipes at exit, nobody reads them
+            iperfs.append(bottomHost.popen(cmd, stdout=DEVNULL, stderr=DEVNULL))
+        for i in range(2, router_count+1):
+            bottomHost = net.get("b{}".format(i))
+            if not wait_until(lambda: listening(bottomHost, IPERF_PORT)):
+                raise RuntimeError("iperf server on {} is not accepting connections".format(bottomHost))
+
+        clients = []
+        for i in range(1, router_count):
+            topHost = net.get("t{}".format(i))
+            cmd = cmd_top.format(i + 1, duration + 2, i, capacities[i] * ct)
+            iperfs.append(topHost.popen(cmd, stdout=DEVNULL, stderr=DEVNULL))
+            clients.append(topHost)
+
+        # Cross traffic is running once every client is connected to its server
+        if not wait_until(lambda: all(connected(host, IPERF_PORT) for host in clients)):
+            waiting = [str(host) for host in clients if not connected(host, IPERF_PORT)]
+            raise RuntimeError("iperf clients on {} did not connect to their servers".format(', '.join(waiting)))
+    except BaseException:
+        stop_processes(iperfs)
+        raise
+    finally:
+        stop_capture(top_dump)
+        stop_capture(bottom_dump)
+    return iperfs
+
+def stop_processes(processes):
+    """
+    Terminate processes started with popen and wait until they exited
+    """
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        wait_for_exit(process)
 
-    for i in range(1, router_count):
-        topHost = net.get("t{}".format(i))
-        cmd = cmd_top.format(i + 1, duration + 2, i, capacities[i] * ct)
-        topHost.popen(cmd, stdout=PIPE, stderr=PIPE)
+def listening(host, port):
+    """
+    Check if a TCP server listens on port in the namespace of host
+    """
+    return re.search(r':{}\b'.format(port), host.cmd('ss -ltn')) is not None
 
-    time.sleep(5)
-    t1.cmd("pkill tcpdump")
-    b2.cmd("pkill tcpdump")
+def connected(host, port):
+    """
+    Check if host has an established TCP connection to a server on port
+    """
+    return re.search(r':{}\b'.format(port), host.cmd('ss -tn state established')) is not None
 
-def inject_and_capture(sender_host, receiver_host, routers=3, packets=300):
+def start_capture(host, command, **kwargs):
+    """
+    Start tcpdump on host and wait until it is capturing
+    :param host: capturing host
+    :param command: tcpdump command line
+    :param kwargs: further arguments of popen, e.g. stdout
+    :return: the tcpdump process
+    """
+    kwargs.setdefault('stdout', PIPE)
+    tcpdump = host.popen(command, stderr=PIPE, **kwargs)
+    if not wait_for_output(tcpdump.stderr, "listening on"):
+        tcpdump.kill()
+        raise RuntimeError("tcpdump on {} did not start capturing".format(host))
+    return tcpdump
+
+def stop_capture(tcpdump):
+    """
+    Stop a tcpdump process started with popen and wait until it has written its capture
     """
-    Wrap-up function that injects traffic into network and captures it with tcpdump
+    tcpdump.terminate()
+    wait_for_exit(tcpdump)
+
+def inject_and_capture(sender_host, receiver_host, routers=3, packets=300, live=False, packet_size=None):
+    """
+    Wrap-up function that injects traffic into network and captures the ICMP replies and the TCP flow with a single tcpdump
     :param sender_host: sender host IP address
     :param receiver_host: receiver host IP address
     :param routers: number of routers in the network
     :param packets: number of packets to target each router
+    :param live: decode and estimate the ICMP replies while they are captured
+    :param packet_size: size of the injected packets, read from data/packet_data.txt if None
+    :return: the finished LiveCapture if live is set, otherwise None
     """
     h1 = sender_host.IP()
     h2 = receiver_host.IP()
-
-    time.sleep(1)
-    sender_host.cmd("tcpdump -n icmp -w results/icmp.pcap &")
-    time.sleep(3)
-    sender_host.cmd("tcpdump -n tcp -w results/tcp.pcap &")
-    time.sleep(3)
-    sender_host.cmd("./TrafficGenerator {} {} {} {}".format(h1, h2, routers, packets))
-    time.sleep(5)
-    sender_host.cmd("pkill tcpdump")
-
-def run_topo(**test_parameters):
+    capture = None
+    if packet_size is None:
+        packet_size = get_packet_size()
+
+    # Packet-buffered captures (-U), so the capture grows while the replies arrive
+    if live:
+        # pcap on stdout, decoded by the capture thread and archived to the capture file
+        tcpdump = start_capture(sender_host, "tcpdump -n -U --time-stamp-precision=nano -w - icmp or tcp")
+        capture = LiveCapture(tcpdump.stdout, packet_size, capture_file)
+        capture.start()
+        progress = lambda: capture.received
+    else:
+        tcpdump = start_capture(sender_host, "tcpdump -n -U --time-stamp-precision=nano -w {} icmp or tcp".format(capture_file), stdout=DEVNULL)
+        progress = lambda: os.path.getsize(capture_file) if os.path.exists(capture_file) else 0
+
+    # TrafficGenerator reads data/packet_data.txt relative to the working directory of the run
+    generator = sender_host.popen("{}/TrafficGenerator {} {} {} {}".format(dir_path, h1, h2, routers, packets),
+                                  stdout=DEVNULL, stderr=DEVNULL)
+    if not wait_for_exit(generator):
+        stop_capture(tcpdump)
+        raise RuntimeError("TrafficGenerator did not finish")
+
+    # Wait for the replies still on their way back
+    wait_until_idle(progress)
+    stop_capture(tcpdump)
+
+    if capture is not None:
+        # tcpdump closes the pipe on exit, which ends the capture thread
+        capture.join(10)
+    return capture
+
+def start_topo(**test_parameters):
     """
-    Run the experiment
+    Build, start and configure the network
     :param test_parameters: test parameters from the .json file
+    :return: network instance and the applied link capacities
     """
     size = test_parameters['topo_size']
-    packet_size = test_parameters['packet_size']
-    packets = test_parameters['packets_per_hop']
-    ct = test_parameters['cross_traffic']
-
-    set_packet_size(packet_size)
+    set_packet_size(test_parameters['packet_size'])
 
     net =  build_topo(size)
     net.build()
     net.start()
-    configure_net(net, size, **test_parameters)
+    capacities = configure_net(net, size, **test_parameters)
 
     # CLI(net)
+    return net, capacities
+
+def reset_topo(net, **test_parameters):
+    """
+    Prepare a running network for the next repeat: draw new link capacities, update the traffic limiters
+    in place and remove the previous capture. Namespaces, links and routes are kept.
+    :param net: network instance returned by start_topo()
+    :param test_parameters: test parameters from the .json file
+    :return: the new link capacities
+    """
+    size = test_parameters['topo_size']
+    a, b = test_parameters['capacity_range']
+    capacities = generate_capacities(a, b, size+1, test_parameters['capacity_delta'])
+    print(capacities)
+    set_capacities(net, size, capacities, 'change')
+    clear_captures()
+    return capacities
+
+def clear_captures():
+    """
+    Remove the capture of the previous repeat and its flow index
+    """
+    for path in (capture_file, capture_file + '.idx.npz'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def measure(net, capacities, **test_parameters):
+    """
+    Apply cross traffic (if configured), inject the probes and capture the replies
+    :param net: network instance returned by start_topo()
+    :param capacities: link capacities of the path
+    :param test_parameters: test parameters from the .json file
+    :return: the finished LiveCapture if live analysis is enabled, otherwise None
+    """
+    size = test_parameters['topo_size']
+    ct = test_parameters['cross_traffic']
 
     h1 = net.get('h1')
     h2 = net.get('h2')
+    iperfs = []
     if(ct > 0):
-        cross_traffic(net, ct, 15, size)
-    inject_and_capture(h1, h2, size, packets)
-
+        iperfs = cross_traffic(net, ct, capacities, 15, size)
+    try:
+        return inject_and_capture(h1, h2, size, test_parameters['packets_per_hop'],
+                                  test_parameters['live_analysis'], test_parameters['packet_size'])
+    finally:
+        # Cross traffic ends with the measurement, so the iperf servers of the next repeat can bind their addresses
+        stop_processes(iperfs)
+
+def stop_topo(net, **test_parameters):
+    """
+    Stop the network and clean up
+    :param net: network instance returned by start_topo()
+    :param test_parameters: test parameters from the .json file
+    """
     net.stop()
-    cleanup()
+    # Runs in their own workspace share the host with concurrent runs, whose processes cleanup() would kill.
+    # Their network namespace disappears with the run anyway
+    if not test_parameters['workspace']:
+        cleanup()
+
+def run_topo(**test_parameters):
+    """
+    Run the experiment on a network built for this run only
+    :param test_parameters: test parameters from the .json file
+    :return: the finished LiveCapture if live analysis is enabled (otherwise None) and the applied link capacities
+    """
+    net, capacities = start_topo(**test_parameters)
+    try:
+        capture = measure(net, capacities, **test_parameters)
+    finally:
+        stop_topo(net, **test_parameters)
+    return capture, capacities
 
 
 # if __name__ == '__main__':
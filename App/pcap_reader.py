@@ -0,0 +1,258 @@
+import mmap
+import socket
+import struct
+import numpy as np
+import pandas as pd
+
+# Decoded packet fields. ts is the capture time in integer nanoseconds since the epoch,
+# tcp_len is -1 for packets that are not TCP segments
+PACKET_DTYPE = np.dtype([
+    ('ts', np.int64),
+    ('src', np.uint32),
+    ('dst', np.uint32),
+    ('proto', np.uint8),
+    ('ip_len', np.int32),
+    ('tcp_len', np.int32),
+    ('ack', np.bool_),
+])
+
+# Magic numbers of the pcap file header and the resolution of their timestamps
+MAGIC_MICROSECONDS = 0xa1b2c3d4
+MAGIC_NANOSECONDS = 0xa1b23c4d
+
+# Supported link types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = 0x8100
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+NS_PER_SECOND = 10 ** 9
+
+def read_header(buf):
+    """
+    Parse the pcap global header
+    :param buf: buffer holding the pcap file
+    :return: byte order prefix for struct, timestamp fraction divisor (fractions per second) and link type
+    """
+    if len(buf) < GLOBAL_HEADER_LEN:
+        raise ValueError('File is too short to be a pcap capture')
+
+    for endian in ('<', '>'):
+        magic = struct.unpack_from(endian + 'I', buf, 0)[0]
+        if magic == MAGIC_MICROSECONDS:
+            divisor = 10 ** 6
+            break
+        if magic == MAGIC_NANOSECONDS:
+            divisor = 10 ** 9
+            break
+    else:
+        raise ValueError('Unknown pcap magic number (pcapng files are not supported)')
+
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0]
+    return endian, divisor, linktype
+
+def record_offsets(buf, endian, start=GLOBAL_HEADER_LEN, end=None):
+    """
+    Walk the record headers and return the offsets of all complete records
+    :param buf: buffer holding the pcap file
+    :param endian: byte order prefix returned by read_header()
+    :param start: offset of the first record header
+    :param end: end of the data to walk, defaults to the end of the buffer
+    :return: array of record header offsets and the offset behind the last complete record
+    """
+    if end is None:
+        end = len(buf)
+    incl_len = struct.Struct(endian + 'I')
+    offsets = []
+    off = start
+    while off + RECORD_HEADER_LEN <= end:
+        nxt = off + RECORD_HEADER_LEN + incl_len.unpack_from(buf, off + 8)[0]
+        if nxt > end:
+            # Truncated record at the end of the capture
+            break
+        offsets.append(off)
+        off = nxt
+    return np.array(offsets, dtype=np.int64), off
+
+def gather(data, pos, nbytes, endian='>'):
+    """
+    Read unsigned integers of nbytes bytes at the positions pos of a uint8 array
+    """
+    value = np.zeros(pos.size, dtype=np.uint64)
+    order = range(nbytes) if endian == '>' else range(nbytes - 1, -1, -1)
+    for i in order:
+        value = (value << np.uint64(8)) | data[pos + i].astype(np.uint64)
+    return value
+
+def decode(buf, offsets, endian, divisor, linktype, return_offsets=False):
+    """
+    Decode the Ethernet/IPv4/ICMP/TCP fields of the records at offsets in bulk.
+    Records that do not carry an IPv4 packet are dropped.
+    :param return_offsets: also return the offsets of the records that were kept
+    :return: structured array of PACKET_DTYPE (and the offsets of its records)
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if offsets.size == 0:
+        packets = np.zeros(0, dtype=PACKET_DTYPE)
+        return (packets, offsets) if return_offsets else packets
+
+    ts_sec = gather(data, offsets, 4, endian)
+    ts_frac = gather(data, offsets + 4, 4, endian)
+    caplen = gather(data, offsets + 8, 4, endian).astype(np.int64)
+    frame = offsets + RECORD_HEADER_LEN
+
+    # Locate the IPv4 header
+    if linktype == LINKTYPE_ETHERNET:
+        ok = caplen >= 14
+        ethertype = np.zeros(offsets.size, dtype=np.uint64)
+        ethertype[ok] = gather(data, frame[ok] + 12, 2)
+        ip = frame + 14
+        vlan = ok & (ethertype == ETHERTYPE_VLAN) & (caplen >= 18)
+        ethertype[vlan] = gather(data, frame[vlan] + 16, 2)
+        ip[vlan] += 4
+        ok &= ethertype == ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ok = caplen >= 16
+        ethertype = np.zeros(offsets.size, dtype=np.uint64)
+        ethertype[ok] = gather(data, frame[ok] + 14, 2)
+        ip = frame + 16
+        ok &= ethertype == ETHERTYPE_IPV4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        ok = caplen >= 1
+        ip = frame
+    else:
+        raise ValueError('Unsupported pcap link type {}'.format(linktype))
+
+    # Require a complete IPv4 header
+    ip_end = frame + caplen
+    ok &= ip + 20 <= ip_end
+    ok[ok] &= (data[ip[ok]] >> 4) == 4
+
+    ts_sec, ts_frac, ip, ip_end = ts_sec[ok], ts_frac[ok], ip[ok], ip_end[ok]
+    packets = np.zeros(ip.size, dtype=PACKET_DTYPE)
+    # Integer arithmetic keeps the full capture resolution, float64 epoch seconds only resolve ~0.2us
+    packets['ts'] = ts_sec.astype(np.int64) * NS_PER_SECOND + ts_frac.astype(np.int64) * (NS_PER_SECOND // divisor)
+    packets['src'] = gather(data, ip + 12, 4)
+    packets['dst'] = gather(data, ip + 16, 4)
+    packets['proto'] = data[ip + 9]
+    packets['ip_len'] = gather(data, ip + 2, 2)
+
+    # TCP payload length and ACK flag, if the TCP header was captured
+    ihl = (data[ip] & 0x0f).astype(np.int64) * 4
+    tcp = ip + ihl
+    is_tcp = (packets['proto'] == IPPROTO_TCP) & (tcp + 14 <= ip_end)
+    doff = (data[tcp[is_tcp] + 12] >> 4).astype(np.int64) * 4
+    packets['tcp_len'] = -1
+    packets['tcp_len'][is_tcp] = packets['ip_len'][is_tcp] - ihl[is_tcp] - doff
+    packets['ack'][is_tcp] = (data[tcp[is_tcp] + 13] & 0x10) != 0
+    if return_offsets:
+        return packets, offsets[ok]
+    return packets
+
+def read_pcap(file_path):
+    """
+    Memory-map a pcap capture and decode all IPv4 packets
+    :param file_path: path of the target .pcap file
+    :return: structured array of PACKET_DTYPE in capture order
+    """
+    with open(file_path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return np.zeros(0, dtype=PACKET_DTYPE)
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        endian, divisor, linktype = read_header(buf)
+        offsets, end = record_offsets(buf, endian)
+        return decode(buf, offsets, endian, divisor, linktype)
+    finally:
+        buf.close()
+
+def read_exactly(f, n):
+    """
+    Read n bytes from a file or pipe, fewer only at the end of the stream
+    """
+    data = b''
+    while len(data) < n:
+        block = f.read(n - len(data))
+        if not block:
+            break
+        data += block
+    return data
+
+def iter_pcap(f, chunk_size=64 * 2 ** 20):
+    """
+    Decode a pcap capture from a binary file object (file or pipe) in chunks of bounded size.
+    Records cut by a chunk boundary are completed with the next chunk.
+    :param f: binary file object positioned at the pcap global header
+    :param chunk_size: number of bytes read at a time
+    :return: generator of structured arrays of PACKET_DTYPE in capture order
+    """
+    header = read_exactly(f, GLOBAL_HEADER_LEN)
+    if len(header) == 0:
+        return
+    endian, divisor, linktype = read_header(header)
+
+    # Pipes return whatever is available instead of blocking until the chunk is full
+    read = getattr(f, 'read1', f.read)
+    buf = b''
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        buf += data
+        offsets, end = record_offsets(buf, endian, start=0)
+        if offsets.size != 0:
+            yield decode(buf, offsets, endian, divisor, linktype)
+        buf = buf[end:]
+
+def parse_timestamps(values):
+    """
+    Convert epoch timestamp strings like "1636671779.430626000" to integer nanoseconds without a detour through float
+    :param values: sequence of timestamp strings
+    :return: int64 array of nanoseconds since the epoch
+    """
+    parts = pd.Series(values, dtype=str).str.strip('"').str.split('.', n=1, expand=True)
+    seconds = parts[0].astype(np.int64).values
+    if parts.shape[1] == 1:
+        return seconds * NS_PER_SECOND
+    fraction = parts[1].fillna('').str.slice(0, 9).str.ljust(9, '0').astype(np.int64).values
+    return seconds * NS_PER_SECOND + fraction
+
+def ns_to_seconds(ns):
+    """
+    Convert integer nanoseconds (typically inter-arrival times) to float seconds for the capacity formula
+    """
+    return np.asarray(ns, dtype=np.float64) / NS_PER_SECOND
+
+def ip_to_int(ip):
+    """
+    Convert a dotted-quad IPv4 address to the integer representation used in decoded packets
+    """
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def ip_to_str(ips):
+    """
+    Convert integer IPv4 addresses to dotted-quad strings
+    """
+    ips = np.asarray(ips, dtype=np.uint32)
+    octets = [pd.Series((ips >> shift) & 255).astype(str) for shift in (24, 16, 8, 0)]
+    return octets[0] + '.' + octets[1] + '.' + octets[2] + '.' + octets[3]
+
+def to_dataframe(packets, columns):
+    """
+    Convert decoded packets to a Pandas DataFrame with dotted-quad addresses, like the tshark csv export
+    :param packets: structured array returned by read_pcap()
+    :param columns: fields to include
+    """
+    data = pd.DataFrame({c: packets[c] for c in columns}, columns=columns)
+    for c in ('src', 'dst'):
+        if c in columns:
+            data[c] = ip_to_str(packets[c]).values
+    return data
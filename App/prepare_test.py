@@ -5,6 +5,10 @@ import json
 from numpy.lib.npyio import save
 
 topo_caps = "data/assigned_capacities.txt"
+# Single capture of the ICMP replies and the end-to-end TCP flow
+capture_file = "results/capture.pcap"
+# Structured results of the runs in a workspace, one json line per run (see results_store)
+runs_file = "results/runs.jsonl"
 
 def generate_capacities(min, max, n_links, capacity_delta=5):
     """
@@ -114,5 +118,42 @@ def get_config_parameters(args):
     repeat_test = data['repeat_test']
     test_config['repeat_test'] = repeat_test
 
+    # Number of processes estimating hop capacities in parallel (optional, defaults to all CPU cores)
+    processes = data.get('processes')
+    assert processes is None or processes > 0, "Number of processes must be a positive number!"
+    test_config['processes'] = processes
+
+    # Directory of the capacity estimate cache (optional, caching is disabled by default)
+    test_config['cache_dir'] = data.get('cache_dir')
+
+    # Number of entries kept in the capacity estimate cache, the least recently used ones are evicted (optional)
+    cache_max_entries = data.get('cache_max_entries', 100000)
+    assert cache_max_entries > 0, "Number of cache entries must be a positive number!"
+    test_config['cache_max_entries'] = cache_max_entries
+
+    # Number of bootstrap resamples for confidence intervals of the hop capacities (optional, 0 disables them)
+    bootstrap = data.get('bootstrap', 0)
+    assert bootstrap >= 0, "Number of bootstrap resamples can't be negative!"
+    test_config['bootstrap'] = bootstrap
+
+    # Read captures in chunks of this many bytes to bound the memory usage (optional, by default captures are read at once)
+    chunk_size = data.get('chunk_size')
+    assert chunk_size is None or chunk_size > 0, "Chunk size must be a positive number!"
+    test_config['chunk_size'] = chunk_size
+
+    # Decode and estimate the ICMP replies while they are captured (optional, disabled by default)
+    test_config['live_analysis'] = data.get('live_analysis', False)
+
+    # Build the network once and only redraw the link capacities between repeats (optional, disabled by default)
+    test_config['reuse_topology'] = data.get('reuse_topology', False)
+
+    # Number of test runs executed concurrently, each in its own network namespace and workspace (optional, runs are sequential by default)
+    parallel_runs = data.get('parallel_runs', 1)
+    assert parallel_runs > 0, "Number of parallel runs must be a positive number!"
+    test_config['parallel_runs'] = parallel_runs
+
+    # Working directory of a single parallel run, set by run_test
+    test_config['workspace'] = None
+
     return test_config
 
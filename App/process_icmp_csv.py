@@ -4,15 +4,18 @@ import PPrate as pp
 import numpy as np
 import pandas as pd
 from prepare_test import get_packet_size
-from prepare_test import topo_caps
+from prepare_test import topo_caps, capture_file
+from pcap_reader import read_pcap, iter_pcap, ip_to_int, ip_to_str, parse_timestamps, NS_PER_SECOND, IPPROTO_ICMP
+from hop_streams import HopStream, HopResult
+from loss_stats import hop_statistics
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 def pcap_to_csv():
     """
-    Convert captured pcap file to csv
+    Convert the captured ICMP replies to csv (requires tshark, the analysis itself reads the pcap directly)
     """
-    command = "tshark -r results/icmp.pcap -T fields -E header=y -E separator=, -E quote=d -E occurrence=f -e frame.time_epoch -e ip.src -e ip.dst -e ip.len > results/icmp.csv"
+    command = "tshark -r results/capture.pcap -Y icmp -T fields -E header=y -E separator=, -E quote=d -E occurrence=f -e frame.time_epoch -e ip.src -e ip.dst -e ip.len > results/icmp.csv"
     os.system(command)
 
 def read_from_csv(file_path):
@@ -20,67 +23,170 @@ def read_from_csv(file_path):
     Reads from csv file and returns a Pandas DataFrame object with full data 
     :param file_path: path of the target .csv file
     """
-    data = pd.read_csv(file_path, sep=',')
+    data = pd.read_csv(file_path, sep=',', converters={0: str})
     data.columns = ['ts', 'src', 'dst', 'ip_len']
+    data['ts'] = parse_timestamps(data['ts'])
 
     return data
 
-def group_by_routers(data, streams):
+def split_flows(packets):
     """
-    Group the captured data based on paths
-    :param data: dataframe containing full data returned by read_from_csv() method
-    :param streams: dictionary containing parsed data
+    Split packets into flows, ordered by the numeric source and destination address
+    :param packets: structured packet array returned by read_pcap()
+    :return: list of (source, destination, key, timestamps, IP sizes) tuples, one per flow
     """
-    for tpl in data.itertuples():
-        if tpl != None:
-            key = "({}, {})".format(make_ip_sortable(tpl.src), tpl.dst)
-            
-            if pd.isna(tpl.src) or pd.isna(tpl.dst):
-                continue
+    # Sort by flow once, the stable sort keeps the capture order within every flow
+    order = np.lexsort((packets['dst'], packets['src']))
+    src = packets['src'][order]
+    dst = packets['dst'][order]
+    ts = packets['ts'][order]
+    ip_len = packets['ip_len'][order]
 
-            # Create new dict entry for new flows
-            if key not in streams:
-                streams[key] = [[], [], [], [], []]
+    # Flows are the contiguous runs of equal (src, dst) pairs
+    starts = np.flatnonzero(np.diff(src.astype(np.int64)) | np.diff(dst.astype(np.int64))) + 1
+    starts = np.insert(starts, 0, 0) if src.size else starts
+    ends = np.append(starts[1:], src.size)
+    names = ip_to_str(np.concatenate((src[starts], dst[starts])))
+
+    flows = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        key = "({}, {})".format(make_ip_sortable(names[i]), names[i + starts.size])
+        flows.append((src[start], dst[start], key, ts[start:end], ip_len[start:end]))
+    return flows
+
+def group_by_routers(packets, streams):
+    """
+    Group the captured data based on paths, ordered by the numeric source and destination address
+    :param packets: structured packet array returned by read_pcap()
+    :param streams: dictionary mapping every hop to its HopStream
+    """
+    group_chunks([packets], streams)
+
+class FlowGrouper(object):
+    """
+    Incremental grouping of decoded packet chunks into hop flows of ICMP replies, other packets are skipped.
+    The last timestamp of every flow is carried from chunk to chunk, so the inter-arrival
+    times are the same as if the whole capture had been grouped at once.
+    """
+
+    def __init__(self):
+        self.last = {}
+        self.parts = {}
+
+    def add(self, packets):
+        """
+        Add a chunk of packets
+        :param packets: structured packet array in capture order
+        :return: list of (key, inter-arrival times) tuples of the flows present in the chunk
+        """
+        new = []
+        packets = packets[packets['proto'] == IPPROTO_ICMP]
+        for src, dst, key, ts, ip_len in split_flows(packets):
+            if key in self.last:
+                iats = calculate_iats(np.insert(ts, 0, self.last[key]))
+            else:
+                self.parts[key] = ((src, dst), [], [], [])
+                iats = calculate_iats(ts)
+            self.last[key] = ts[-1]
+            self.parts[key][1].append(ts)
+            self.parts[key][2].append(iats)
+            self.parts[key][3].append(ip_len)
+            new.append((key, iats))
+        return new
+
+    def fill(self, streams):
+        """
+        Store the grouped flows in streams, ordered by the numeric source and destination address
+        :param streams: dictionary mapping every hop to its HopStream
+        """
+        # Flows can first show up in any chunk, restore the numeric order
+        for key in sorted(self.parts, key=lambda k: self.parts[k][0]):
+            (src, dst), ts, iats, ip_len = self.parts[key]
+            streams[key] = HopStream(key, src, dst, np.concatenate(ts), np.concatenate(iats), np.concatenate(ip_len))
+
+def hop_flow(hop, receiver_ip='10.0.0.10'):
+    """
+    Flow of the ICMP replies of a hop: router i answers from its left interface 10.0.{i-1}.2
+    :param hop: hop position, starting at 1
+    :param receiver_ip: IP address of the probing host
+    """
+    return '10.0.{}.2'.format(hop - 1), receiver_ip
+
+def path_hops(streams, size):
+    """
+    Order the grouped flows by hop position and add an empty HopStream for every hop that sent no reply,
+    so such hops are reported with 100% loss instead of disappearing
+    :param streams: dictionary mapping every hop to its HopStream, e.g. filled by FlowGrouper.fill()
+    :param size: number of routers
+    :return: dictionary mapping the hops 1..size to their HopStreams, flows of other sources are dropped
+    """
+    hops = {}
+    for hop in range(1, size + 1):
+        src, dst = hop_flow(hop)
+        key = "({}, {})".format(make_ip_sortable(src), dst)
+        if key in streams:
+            hops[key] = streams[key]
+        else:
+            empty = np.zeros(0, dtype=np.int64)
+            hops[key] = HopStream(key, ip_to_int(src), ip_to_int(dst), empty, empty, empty)
+            hops[key].result = HopResult(-1, None, None)
+    return hops
+
+def group_chunks(chunks, streams):
+    """
+    Group the captured data chunk by chunk, ordered by the numeric source and destination address
+    :param chunks: iterable of structured packet arrays in capture order, e.g. from iter_pcap()
+    :param streams: dictionary mapping every hop to its HopStream
+    """
+    grouper = FlowGrouper()
+    for packets in chunks:
+        grouper.add(packets)
+    grouper.fill(streams)
 
-            # Append timestamp, IP size and TCP length to flow
-            streams[key][0].append(tpl.ts)
-            streams[key][1].append(tpl.ip_len)
-    
 def calculate_iats(timestamps):
     """
     Calculates inter-arrival times for packet pairs
-    :param timestamps: timestamps based on which inter-arrival times are calculated
+    :param timestamps: timestamps in integer nanoseconds based on which inter-arrival times are calculated
+    :return: inter-arrival times in integer nanoseconds
     """
-    iats = []
-    for i, ts in enumerate(timestamps):
-        if(i == 0):
-            # iats.append(0)
-            continue
-        iat = ts - timestamps[i-1]
-        if(iat > 0 and iat < 1.0):
-            iats.append(iat)
-    # print(iats)
-    return iats
+    iats = np.diff(np.asarray(timestamps, dtype=np.int64))
+    return iats[(iats > 0) & (iats < NS_PER_SECOND)]
 
-def calculate_capacities():
+def calculate_capacities(processes=None, cache=None, chunk_size=None):
     """
     Calculate capacities based on inter-arrival times and packet size using PPrate 
+    :param processes: number of processes estimating hops in parallel, defaults to the number of CPU cores
+    :param cache: optional CapacityCache that memoizes the estimates
+    :param chunk_size: read the capture in chunks of this many bytes to bound the memory usage, None reads it at once
+    :return: dictionary mapping every hop to its HopStream, in numeric address order
     """
-    pcap_to_csv()
-    filepath = dir_path + "/results/icmp.csv"
+    filepath = capture_file
     streams = {}
-
-    df = read_from_csv(filepath)
     packet_size = get_packet_size()
-    group_by_routers(df, streams)
-    results = []
-    for key in sorted(streams):
-        streams[key][0] = calculate_iats(streams[key][0])
-        # Call PPrate algorithm
-        cap = pp.find_capacity(packet_size, streams[key][0])
-        cap = bit_to_mbit(cap)
-        streams[key][2] = cap
-        results.append(cap)
+
+    if chunk_size is None:
+        group_chunks([read_pcap(filepath)], streams)
+    else:
+        with open(filepath, 'rb') as f:
+            group_chunks(iter_pcap(f, chunk_size), streams)
+    return estimate_streams(streams, packet_size, processes, cache)
+
+def estimate_streams(streams, packet_size, processes=None, cache=None):
+    """
+    Estimate the capacity of every grouped hop and store it in Mbit/s as the HopResult of the hop
+    :param streams: dictionary of HopStreams filled by group_chunks() or FlowGrouper.fill()
+    :param packet_size: size of the injected packets in bytes
+    :param processes: number of processes estimating hops in parallel
+    :param cache: optional CapacityCache that memoizes the estimates
+    """
+    keys = list(streams)
+
+    # Call PPrate algorithm for all hops at once
+    find_capacities = pp.find_capacities if cache is None else cache.find_capacities
+    caps = find_capacities(packet_size, [streams[key].iats_seconds() for key in keys], processes)
+    for key, cap in zip(keys, caps):
+        # -1 marks hops PPrate could not estimate, e.g. without usable inter-arrival times
+        streams[key].result = HopResult(bit_to_mbit(cap) if cap != -1 else -1, None, None)
         # print("{} -> {}".format(key, cap))
     return streams
 
@@ -93,16 +199,18 @@ def get_assigned_capacities(file=topo_caps):
     capacities = textfile.read().split('\n')
     textfile.close()
     del capacities[-1]
-    capacities = map(int, capacities)
+    capacities = list(map(int, capacities))
     
     return capacities
 
-def get_expected_capacities():
+def get_expected_capacities(capacities=None):
     """
     Calculate expected capacities based on capacity distribution
     Expected capacities are path capacities to each router
+    :param capacities: list of link capacities, read from the file if None
     """
-    capacities = get_assigned_capacities()
+    if capacities is None:
+        capacities = get_assigned_capacities()
     expected = []
     min = capacities[0]
     for cap in capacities:
@@ -140,19 +248,55 @@ def make_ip_sortable(s):
     return ret
 
 
-def get_results():
+def get_results(processes=None, cache=None, bootstrap=0, chunk_size=None, streams=None, packets_per_hop=None,
+                capacities=None, packet_size=None, size=None):
     """
     Wrap-up function to deliver final results
+    :param processes: number of processes estimating hops in parallel
+    :param cache: optional CapacityCache that memoizes the estimates
+    :param bootstrap: number of bootstrap resamples for the confidence intervals of the estimates, 0 disables them
+    :param chunk_size: read the capture in chunks of this many bytes, None reads it at once
+    :param streams: hops already estimated during the capture (see LiveCapture), None reads and estimates the capture
+    :param packets_per_hop: number of probes sent towards every hop, adds the reply statistics of every hop if set
+    :param capacities: link capacities applied to the path, read from the file if None
+    :param packet_size: size of the injected packets, read from the file if None
+    :param size: number of routers, reports every hop of the path (also those without replies) if set
+    :return: dictionary mapping every hop to its HopStream
     """
-    streams = calculate_capacities()
-    expected = get_expected_capacities()
+    if streams is None:
+        streams = calculate_capacities(processes, cache, chunk_size)
+    if size is not None:
+        streams = path_hops(streams, size)
+    if packets_per_hop is not None:
+        hop_statistics(streams, packets_per_hop)
+    expected = get_expected_capacities(capacities)
+    if packet_size is None:
+        packet_size = get_packet_size()
+    lower = upper = [None] * len(streams)
+    if bootstrap > 0:
+        # Resample all hops at once, with a fixed seed so the intervals are reproducible and cacheable
+        bootstrap_intervals = pp.bootstrap_intervals if cache is None else cache.bootstrap_intervals
+        lower, upper = bootstrap_intervals(packet_size, [streams[key].iats_seconds() for key in streams],
+                                           bootstrap, processes, 0)
+        lower, upper = bit_to_mbit(lower), bit_to_mbit(upper)
     i = 0
     print("path -> estimated capacity -> expected capacity -> relative error")
-    for key in sorted(streams):
-        streams[key][3] = expected[i]
-        streams[key][4] = get_relative_error(streams[key][3], streams[key][2])
+    for key in streams:
+        capacity = streams[key].result.capacity
+        # Hops without replies or usable inter-arrival times have no estimate to compare
+        error = get_relative_error(expected[i], capacity) if capacity != -1 else None
+        result = HopResult(capacity, expected[i], error, lower[i], upper[i])
+        streams[key].result = result
         i += 1
-        print("{} -> {} -> {} -> {}%".format(key, streams[key][2], streams[key][3], streams[key][4]))
+        print("{} -> {} -> {} -> {}%".format(key, result.capacity, result.expected, result.error))
+        if result.lower is not None:
+            print("    95% confidence interval: [{}, {}]".format(result.lower, result.upper))
+        stats = streams[key].stats
+        if stats is not None:
+            print("    received {}/{} ({}% loss), {} reordered, {} gaps, IAT median/p95/max {:.3f}/{:.3f}/{:.3f}ms".format(
+                stats.received, stats.sent, stats.loss, stats.reordered, stats.gaps,
+                stats.gap_median, stats.gap_p95, stats.gap_max))
+    return streams
 
 
 # if __name__ == '__main__':
@@ -2,87 +2,85 @@ import os
 import PPrate as pp
 import numpy as np
 import pandas as pd
-from prepare_test import get_packet_size
+from prepare_test import get_packet_size, capture_file
+from pcap_reader import read_pcap, iter_pcap, ip_to_int, parse_timestamps, ns_to_seconds, PACKET_DTYPE, IPPROTO_TCP
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 def pcap_to_csv():
     """
-    Convert captured pcap file to csv
+    Convert captured pcap file to csv (requires tshark, the analysis itself reads the pcap directly)
     """
-    os.system("tshark -r results/tcp.pcap -T fields -E header=y -E separator=, -E quote=d -E occurrence=f -e frame.time_epoch -e ip.src -e ip.dst -e ip.len -e tcp.len -e tcp.flags.ack> results/tcp.csv")
+    os.system("tshark -r results/capture.pcap -Y tcp -T fields -E header=y -E separator=, -E quote=d -E occurrence=f -e frame.time_epoch -e ip.src -e ip.dst -e ip.len -e tcp.len -e tcp.flags.ack> results/tcp.csv")
 
 def read_from_csv(file_path):
     """
     Reads from csv file and returns a Pandas DataFrame object with full data 
     """
-    data = pd.read_csv(file_path, sep=',')
+    data = pd.read_csv(file_path, sep=',', converters={0: str})
     data.columns = ['ts', 'src', 'dst', 'ip_len', 'tcp_len', 'ack']
+    data['ts'] = parse_timestamps(data['ts'])
     
     return data
 
-def calculate_total_capacity(data, flows, size):
+def flow_addresses(size):
     """
-    Process data using the receiver algorithm and derive capacity using PPrate algorithm
-    :param data: Pandas dataframe containing packet traces
-    :param flows: dict containing all flows
-    :param sender_ip: IP address of the sender host
-    :param receiver_ip: IP address of the receiver host
-    :param size: Packet size to be used for the PPrate algorithm.
-        Default value is the Ethernet frame size of 1514 Bytes which includes a MSS of 1460 Bytes.
-    :param sampling_factor: Define sampling factor. 1 = Sampling disabled
-    :return: Capacity Estimate in bit/s
+    IP addresses of the sender and the receiver host of the analyzed flow
+    :param size: number of routers
     """
-    # Iterate through segments
-    for p in data.itertuples():
-        # Only inspect data segments
-        if p != None:
-            # Address flow via IP address
-            key = (p.src, p.dst)
-
-            if pd.isna(p.src) or pd.isna(p.dst):
-                continue
+    return "10.0.{}.10".format(size), "10.0.0.10"
 
-            # Create new dict entry for new flows
-            if key not in flows:
-                flows[key] = [[], [], [], []]
+def select_flow(packets, size):
+    """
+    Return the TCP segments of the sender -> receiver flow
+    :param packets: structured packet array returned by read_pcap(), the capture also holds ICMP packets
+    :param size: number of routers
+    """
+    sender_ip, receiver_ip = flow_addresses(size)
+    return packets[(packets['proto'] == IPPROTO_TCP) & (packets['src'] == ip_to_int(sender_ip)) &
+                   (packets['dst'] == ip_to_int(receiver_ip))]
 
-            # Append timestamp, IP size and TCP length to flow
-            flows[key][0].append(p.ts)
-            flows[key][1].append(p.ip_len)
-            flows[key][2].append(p.tcp_len)
+def calculate_total_capacity(packets, flows, size, packet_size=None):
+    """
+    Process data using the receiver algorithm and derive capacity using PPrate algorithm
+    :param packets: structured packet array returned by read_pcap()
+    :param flows: dict the sender -> receiver flow is stored in as inter-arrival times (ns), IP sizes, TCP lengths and ACK flags
+    :param size: number of routers, which determines the IP address of the sender host
+    :param packet_size: size of the injected packets, read from the file if None
+    :return: Capacity Estimate in Mbit/s
+    """
+    sender_ip, receiver_ip = flow_addresses(size)
 
-            # Append ACK flag status
-            if pd.isna(p.ack):
-                flows[key][3].append(False)
-            else:
-                flows[key][3].append(True)
+    # Select the segments of the sender -> receiver flow
+    f = select_flow(packets, size)
+    if f.size == 0:
+        raise KeyError((sender_ip, receiver_ip))
 
-    # Calculate Inter-Arrival-Times
-    iats = []
-    sender_ip = "10.0.{}.10".format(size)
-    receiver_ip = "10.0.0.10"
+    # Calculate Inter-Arrival-Times in integer nanoseconds
+    iats = np.insert(np.diff(f['ts']), 0, 0)
 
-    f = flows[(sender_ip, receiver_ip)]
-    for i, ts in enumerate(f[0]):
-        if i == 0:
-            iats.append(0)
-        else:
-            iats.append((ts - f[0][i - 1]))
+    # ACK flag status, only set for TCP segments
+    ack = f['ack'] & (f['tcp_len'] >= 0)
+    flows[(sender_ip, receiver_ip)] = [iats, f['ip_len'], f['tcp_len'], ack]
 
-    size = get_packet_size()
-    f[0] = np.array(iats)
-    return bit_to_mbit(pp.find_capacity(size, iats))
+    if packet_size is None:
+        packet_size = get_packet_size()
+    return bit_to_mbit(pp.find_capacity(packet_size, ns_to_seconds(iats)))
 
-def get_network_capacity(size):
+def get_network_capacity(size, chunk_size=None):
     """
     Wrap-up method that reads data from file and returns the total capacity of the network
+    :param chunk_size: read the capture in chunks of this many bytes and only keep the analyzed flow, None reads it at once
     """
-    filepath = dir_path + '/results/tcp.csv'
-    pcap_to_csv()
+    filepath = capture_file
     flows = {}
-    data = read_from_csv(filepath)
-    cap = calculate_total_capacity(data, flows, size)
+    if chunk_size is None:
+        packets = read_pcap(filepath)
+    else:
+        with open(filepath, 'rb') as f:
+            packets = np.concatenate([select_flow(chunk, size) for chunk in iter_pcap(f, chunk_size)] +
+                                     [np.zeros(0, dtype=PACKET_DTYPE)])
+    cap = calculate_total_capacity(packets, flows, size)
     return cap
 
 def bit_to_mbit(bits):
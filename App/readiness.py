@@ -0,0 +1,90 @@
+import os
+import time
+import select
+import subprocess
+
+# Upper bounds of the waits in seconds
+START_TIMEOUT = 10
+EXIT_TIMEOUT = 120
+FLUSH_TIMEOUT = 5
+# A capture counts as flushed once it did not grow for this many seconds
+IDLE_TIME = 0.5
+POLL_INTERVAL = 0.05
+
+def wait_for_output(stream, text, timeout=START_TIMEOUT):
+    """
+    Read a pipe of a process until text shows up, e.g. "listening on" in the stderr of tcpdump
+    :param stream: pipe of the process
+    :param text: text to wait for
+    :param timeout: seconds to wait at most
+    :return: True if the text showed up, False on timeout or if the process closed the pipe
+    """
+    deadline = time.time() + timeout
+    fd = stream.fileno()
+    needle = text.encode()
+    data = b''
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            return False
+        block = os.read(fd, 4096)
+        if not block:
+            return False
+        # Keep enough of the previous data to find text split over two reads
+        data = data[-len(needle):] + block
+        if needle in data:
+            return True
+
+def wait_until(condition, timeout=START_TIMEOUT, interval=POLL_INTERVAL):
+    """
+    Poll condition until it holds
+    :param condition: function returning True once the awaited state is reached
+    :param timeout: seconds to wait at most
+    :return: True if the condition holds, False on timeout
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def wait_until_idle(progress, idle=IDLE_TIME, timeout=FLUSH_TIMEOUT, interval=POLL_INTERVAL):
+    """
+    Wait until a growing quantity (captured bytes or packets) stopped growing for idle seconds
+    :param progress: function returning the current value of the quantity
+    :param idle: seconds without growth that count as idle
+    :param timeout: seconds to wait at most
+    :return: True if the quantity went idle, False on timeout
+    """
+    deadline = time.time() + timeout
+    last = progress()
+    changed = time.time()
+    while True:
+        now = time.time()
+        if now - changed >= idle:
+            return True
+        if now >= deadline:
+            return False
+        time.sleep(interval)
+        value = progress()
+        if value != last:
+            last = value
+            changed = time.time()
+
+def wait_for_exit(process, timeout=EXIT_TIMEOUT):
+    """
+    Wait until a process exits, kill it on timeout
+    :param process: Popen object
+    :return: True if the process exited on its own
+    """
+    try:
+        process.wait(timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        return False
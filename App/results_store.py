@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import pandas as pd
+from prepare_test import runs_file
+
+def plain(value):
+    """
+    Python number of a numpy scalar, other values unchanged
+    """
+    return value.item() if hasattr(value, 'item') else value
+
+def run_record(streams, total_capacity, capacities):
+    """
+    Structured results of a single run
+    :param streams: dictionary mapping every hop to its HopStream, as returned by get_results()
+    :param total_capacity: end-to-end capacity in Mbit/s
+    :param capacities: link capacities applied during the run
+    :return: json serializable dictionary
+    """
+    hops = []
+    for i, key in enumerate(streams):
+        hop = {'hop': i, 'path': key}
+        hop.update((field, plain(value)) for field, value in streams[key].result._asdict().items())
+        stats = streams[key].stats
+        if stats is not None:
+            hop.update((field, plain(value)) for field, value in stats._asdict().items())
+        hops.append(hop)
+    return {'end_to_end': plain(total_capacity), 'capacities': [plain(c) for c in capacities], 'hops': hops}
+
+def append_run(record, path=runs_file):
+    """
+    Append the record of a run as a json line
+    :param path: file of the records, relative to the working directory of the run
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def read_runs(path=runs_file):
+    """
+    Read the records of the runs in a file, an unfinished last line is skipped
+    :return: list of records, empty if the file is missing
+    """
+    records = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+    except (IOError, OSError):
+        pass
+    return records
+
+# Columns of a hop row besides point, repeat and hop, in the order of HopResult and HopStats
+HOP_COLUMNS = ['path', 'capacity', 'expected', 'error', 'lower', 'upper', 'received', 'sent', 'loss', 'reordered', 'gaps',
+               'gap_median', 'gap_p95', 'gap_max']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (id INTEGER PRIMARY KEY, config TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS point_params (point INTEGER NOT NULL, name TEXT NOT NULL, value,
+                                         PRIMARY KEY (point, name));
+CREATE INDEX IF NOT EXISTS point_params_value ON point_params (name, value);
+CREATE TABLE IF NOT EXISTS runs (point INTEGER NOT NULL, repeat INTEGER NOT NULL, status TEXT NOT NULL,
+                                 exit_code INTEGER, end_to_end REAL, capacities TEXT, workspace TEXT, finished REAL,
+                                 PRIMARY KEY (point, repeat));
+CREATE TABLE IF NOT EXISTS hops (point INTEGER NOT NULL, repeat INTEGER NOT NULL, hop INTEGER NOT NULL, path TEXT,
+                                 capacity REAL, expected REAL, error REAL, lower REAL, upper REAL, received INTEGER,
+                                 sent INTEGER, loss REAL, reordered INTEGER, gaps INTEGER, gap_median REAL,
+                                 gap_p95 REAL, gap_max REAL,
+                                 PRIMARY KEY (point, repeat, hop));
+"""
+
+def param_value(value):
+    """
+    Value of a swept parameter as stored in the store: numbers and strings as they are, anything else as json
+    """
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return json.dumps(value)
+
+class ResultsStore(object):
+    """
+    Single sqlite file holding the results of a parameter sweep (see sweep.py).
+    A point is one concrete config of the sweep, identified by its canonical json; its swept parameters are
+    indexed in point_params. Every repeat of a point is a row of runs, whose status is the checkpoint of the
+    sweep, and the hop results of a repeat are rows of hops. Only the process scheduling the sweep writes.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: sqlite file, created if missing
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def add_point(self, config, params):
+        """
+        Return the id of the point of config, adding it if it is new
+        :param config: full config dictionary of the point
+        :param params: swept parameters of the point and their values
+        """
+        key = json.dumps(config, sort_keys=True)
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO points (config) VALUES (?)', (key,))
+            point = self.db.execute('SELECT id FROM points WHERE config = ?', (key,)).fetchone()[0]
+            self.db.executemany('INSERT OR REPLACE INTO point_params (point, name, value) VALUES (?, ?, ?)',
+                                [(point, name, param_value(value)) for name, value in params.items()])
+        return point
+
+    def finished(self, point):
+        """
+        Repeats of a point that completed successfully
+        """
+        rows = self.db.execute("SELECT repeat FROM runs WHERE point = ? AND status = 'done'", (point,))
+        return set(row[0] for row in rows)
+
+    def add_run(self, point, repeat, record, workspace=None):
+        """
+        Store the results of a successful repeat, replacing earlier attempts
+        :param record: record of the run, see run_record()
+        """
+        with self.db:
+            self.db.execute('DELETE FROM hops WHERE point = ? AND repeat = ?', (point, repeat))
+            self.db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (point, repeat, 'done', 0, record['end_to_end'], json.dumps(record['capacities']),
+                             workspace, time.time()))
+            self.db.executemany('INSERT INTO hops VALUES ({})'.format(', '.join('?' * (len(HOP_COLUMNS) + 3))),
+                                [[point, repeat, hop['hop']] + [hop.get(column) for column in HOP_COLUMNS]
+                                 for hop in record['hops']])
+
+    def add_failure(self, point, repeat, exit_code, workspace=None):
+        """
+        Mark a repeat as failed, so a resumed sweep runs it again
+        """
+        with self.db:
+            self.db.execute('DELETE FROM hops WHERE point = ? AND repeat = ?', (point, repeat))
+            self.db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (point, repeat, 'failed', exit_code, None, None, workspace, time.time()))
+
+    def hop_results(self, parameter, **fixed):
+        """
+        Hop results of all successful repeats together with the value of a swept parameter
+        :param parameter: name of the swept parameter
+        :param fixed: values of other swept parameters the results are restricted to
+        :return: DataFrame with the columns value, point, repeat, hop and HOP_COLUMNS, ordered by value
+        """
+        query = ('SELECT p.value AS value, h.* FROM hops h '
+                 'JOIN runs r ON r.point = h.point AND r.repeat = h.repeat '
+                 'JOIN point_params p ON p.point = h.point AND p.name = ? ')
+        args = [parameter]
+        for i, (name, value) in enumerate(fixed.items()):
+            query += ('JOIN point_params f{0} ON f{0}.point = h.point AND f{0}.name = ? AND f{0}.value = ? '.format(i))
+            args += [name, param_value(value)]
+        query += "WHERE r.status = 'done' ORDER BY p.value, h.point, h.repeat, h.hop"
+        return pd.read_sql_query(query, self.db, params=args)
+
+    def progress(self):
+        """
+        Number of finished and failed repeats
+        """
+        rows = dict(self.db.execute('SELECT status, COUNT(*) FROM runs GROUP BY status').fetchall())
+        return rows.get('done', 0), rows.get('failed', 0)
@@ -1,35 +1,170 @@
 import os
 import sys
 import argparse
+import subprocess
+import multiprocessing
 import prepare_test
-from mininet_topo import run_topo
+from concurrent.futures import ThreadPoolExecutor
+from mininet_topo import run_topo, start_topo, reset_topo, measure, stop_topo
 from mininet.log import setLogLevel, info
 from process_icmp_csv import get_results
-from process_tcp_csv import get_network_capacity
+from process_tcp_csv import calculate_total_capacity
+from capture_analysis import analyze_capture
+from capacity_cache import CapacityCache
+from results_store import run_record, append_run
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
 
 def run(**test_parameters):
     """
     Run the experiment based on test parameters read from .json file
     :param test_parameters: test parameters read from config.json file
+    :return: dictionary mapping every hop to its HopStream
+    """
+    capture, capacities = run_topo(**test_parameters)
+    return analyze(capture, capacities, **test_parameters)
+
+def analyze(capture, capacities, **test_parameters):
+    """
+    Estimate and print the hop capacities and the end-to-end capacity of a run
+    :param capture: LiveCapture of the run, None to read the capture file
+    :param capacities: link capacities applied during the run
+    :param test_parameters: test parameters read from config.json file
+    :return: dictionary mapping every hop to its HopStream
     """
-    run_topo(**test_parameters)
-    get_results()
-    total_capacity = get_network_capacity(test_parameters['topo_size'])
+    cache = None
+    if test_parameters['cache_dir']:
+        cache = CapacityCache(test_parameters['cache_dir'], test_parameters['cache_max_entries'])
+    # Both estimators are fed from one decoding pass over the capture
+    size = test_parameters['topo_size']
+    packet_size = test_parameters['packet_size']
+    if capture is not None:
+        streams = capture.results(test_parameters['processes'], cache)
+        total_capacity = calculate_total_capacity(capture.tcp_packets(), {}, size, packet_size)
+    else:
+        streams, total_capacity = analyze_capture(size, test_parameters['processes'], cache, test_parameters['chunk_size'], packet_size)
+    streams = get_results(test_parameters['processes'], cache, test_parameters['bootstrap'], test_parameters['chunk_size'],
+                          streams, test_parameters['packets_per_hop'], capacities, packet_size, size)
     print("end-to-end capacity = {}mbps".format(total_capacity))
+    if test_parameters['workspace']:
+        # Read back by parameter sweeps
+        append_run(run_record(streams, total_capacity, capacities))
+    return streams
 
-def analyze_packet_loss(**test_parameters):
+def analyze_packet_loss(streams, **test_parameters):
     """
     Print the received/sent packets ratio after the test run
+    :param streams: hops returned by run(), with their reply statistics
     :param test_parameters: test parameters passed via .json file
     """
     total_packects = test_parameters['topo_size']*test_parameters['packets_per_hop']
-    captured_packets = open("results/icmp.csv")
-    lines = captured_packets.readlines()
-    captured_packets_count = len(lines) - 1
+    captured_packets_count = sum(streams[key].stats.received for key in streams)
     packet_loss_details = "{}/{} packets captured at the source host\n".format(captured_packets_count, total_packects)
     
     print(packet_loss_details)
 
+def run_repeats(repeat_test, **test_parameters):
+    """
+    Run the experiment repeat_test times one after another
+    :return: True if all runs succeeded
+    """
+    if test_parameters['reuse_topology'] and repeat_test > 1:
+        return run_repeats_persistent(repeat_test, **test_parameters)
+
+    success = True
+    for i in range(repeat_test):
+        try:
+            streams = run(**test_parameters)
+            analyze_packet_loss(streams, **test_parameters)
+        except BaseException as e:
+            print("error occured...\n")
+            print(e)
+            success = False
+            continue
+    return success
+
+def run_repeats_persistent(repeat_test, **test_parameters):
+    """
+    Run the experiment repeat_test times on one network, which is only reconfigured between the repeats
+    :return: True if all runs succeeded
+    """
+    success = True
+    net, capacities = start_topo(**test_parameters)
+    try:
+        for i in range(repeat_test):
+            try:
+                if i > 0:
+                    capacities = reset_topo(net, **test_parameters)
+                capture = measure(net, capacities, **test_parameters)
+                streams = analyze(capture, capacities, **test_parameters)
+                analyze_packet_loss(streams, **test_parameters)
+            except BaseException as e:
+                print("error occured...\n")
+                print(e)
+                success = False
+                continue
+    finally:
+        stop_topo(net, **test_parameters)
+    return success
+
+def run_in_workspace(config, workspace, processes=None, repeats=1):
+    """
+    Run a single experiment in a child process with its own network namespace and working directory,
+    so its Mininet nodes, interfaces and artifacts can't collide with concurrent runs
+    :param config: path of the config file
+    :param workspace: directory receiving data/, results/ and the output of the run
+    :param processes: number of processes estimating hop capacities in the run
+    :param repeats: number of repeats executed in the workspace
+    :return: exit code of the run
+    """
+    for folder in ('data', 'results', 'top_bottom_hosts'):
+        os.makedirs(os.path.join(workspace, folder), exist_ok=True)
+
+    command = ['unshare', '--net', sys.executable, os.path.join(dir_path, 'run_test.py'),
+               os.path.abspath(config), '--workspace', workspace]
+    if processes is not None:
+        command += ['--processes', str(processes)]
+    if repeats != 1:
+        command += ['--repeats', str(repeats)]
+    with open(os.path.join(workspace, 'output.txt'), 'w') as output:
+        return subprocess.call(command, stdout=output, stderr=subprocess.STDOUT)
+
+def run_parallel(config, **test_parameters):
+    """
+    Run the repeats of an experiment concurrently, bounded by the number of CPU cores.
+    Every run gets its own workspace below results/<folder_name>/, the outputs are printed in run order.
+    With a reused topology the repeats are split between the workers instead, so each worker builds its network once.
+    :param config: path of the config file
+    :param test_parameters: test parameters passed via .json file
+    :return: True if all runs succeeded
+    """
+    repeat_test = test_parameters['repeat_test']
+    cores = multiprocessing.cpu_count()
+    workers = max(1, min(test_parameters['parallel_runs'], cores, repeat_test))
+
+    # Share the cores between the hop estimations of concurrent runs
+    processes = test_parameters['processes']
+    if processes is None:
+        processes = max(1, cores // workers)
+
+    root = os.path.join(dir_path, 'results', os.path.basename(test_parameters['folder_name']))
+    if test_parameters['reuse_topology']:
+        repeats = [repeat_test // workers + (i < repeat_test % workers) for i in range(workers)]
+    else:
+        repeats = [1] * repeat_test
+    workspaces = [os.path.join(root, 'run_{:03d}'.format(i + 1)) for i in range(len(repeats))]
+    success = True
+    with ThreadPoolExecutor(workers) as pool:
+        codes = pool.map(lambda job: run_in_workspace(config, job[0], processes, job[1]), zip(workspaces, repeats))
+        for workspace, code in zip(workspaces, codes):
+            with open(os.path.join(workspace, 'output.txt')) as output:
+                print(output.read())
+            if code != 0:
+                print("error occured...\n")
+                print("run in {} exited with code {}".format(workspace, code))
+                success = False
+    return success
+
 def main():
     """
     Wrap-up method. 
@@ -39,21 +174,26 @@ def main():
     # Argument parser
     parser = argparse.ArgumentParser()
     parser.add_argument('config', help='Path to the config file')
+    parser.add_argument('--workspace', help='run a single experiment in this directory (used by parallel runs)')
+    parser.add_argument('--processes', type=int, help='override the number of processes estimating hop capacities')
+    parser.add_argument('--repeats', type=int, default=1, help='number of repeats of a single parallel run')
     args = parser.parse_args()
 
     test_parameters = prepare_test.get_config_parameters(args)
+    if args.processes is not None:
+        test_parameters['processes'] = args.processes
     
     # print(test_parameters)
     
-    repeat_test = test_parameters['repeat_test']
-    for i in range(repeat_test):
-        try:
-            run(**test_parameters)
-            analyze_packet_loss(**test_parameters)
-        except BaseException as e:
-            print("error occured...\n")
-            print(e)
-            continue
+    if args.workspace:
+        # Single run of a parallel experiment, all relative paths resolve inside the workspace
+        os.chdir(args.workspace)
+        test_parameters['workspace'] = args.workspace
+        sys.exit(0 if run_repeats(args.repeats, **test_parameters) else 1)
+    elif test_parameters['parallel_runs'] > 1:
+        sys.exit(0 if run_parallel(args.config, **test_parameters) else 1)
+    else:
+        sys.exit(0 if run_repeats(test_parameters['repeat_test'], **test_parameters) else 1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import argparse
+import itertools
+import multiprocessing
+import prepare_test
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from prepare_test import runs_file
+from run_test import run_in_workspace, dir_path
+from results_store import ResultsStore, read_runs
+
+# Parameters whose plain value is already a list, they are swept by a list of such lists
+LIST_PARAMETERS = ('capacity_range',)
+
+def range_values(start, stop, step=1):
+    """
+    Values of a {"range": [start, stop, step]} parameter, stop included
+    """
+    assert step > 0, "Range step must be a positive number!"
+    values = []
+    i = 0
+    while start + i * step <= stop + abs(step) * 1e-9:
+        value = start + i * step
+        values.append(round(value, 9) if isinstance(value, float) else value)
+        i += 1
+    return values
+
+def parameter_values(name, value):
+    """
+    Values a parameter is swept over
+    :param name: name of the parameter
+    :param value: value of the parameter in the config file
+    :return: list of values, None if the parameter is not swept
+    """
+    if isinstance(value, dict) and 'range' in value:
+        return range_values(*value['range'])
+    if isinstance(value, list):
+        if name in LIST_PARAMETERS and not all(isinstance(v, list) for v in value):
+            return None
+        return value
+    return None
+
+def expand_grid(data):
+    """
+    Expand the lists and ranges of a sweep config into the grid of its points
+    :param data: content of the config file
+    :return: names of the swept parameters and the list of (config, params) of all points, where config is
+    the full config of the point with single values and params maps the swept parameters to their values
+    """
+    swept = []
+    values = []
+    for name in data:
+        v = parameter_values(name, data[name])
+        if v is not None:
+            assert len(v) > 0, "Swept parameter {} has no values!".format(name)
+            swept.append(name)
+            values.append(v)
+
+    points = []
+    for combination in itertools.product(*values):
+        params = dict(zip(swept, combination))
+        config = dict(data)
+        config.update(params)
+        points.append((config, params))
+    return swept, points
+
+def describe(params):
+    """
+    Printable "name=value, ..." form of the swept parameters of a point
+    """
+    return ', '.join('{}={}'.format(name, value) for name, value in params.items())
+
+def prepare_points(data, folder, store):
+    """
+    Write the config of every point below folder, validate it and register the point in the store
+    :return: list of (point id, config path, repeats, params)
+    """
+    points = expand_grid(data)[1]
+    prepared = []
+    for config, params in points:
+        point = store.add_point(config, params)
+        point_folder = os.path.join(folder, 'point_{:03d}'.format(point))
+        os.makedirs(point_folder, exist_ok=True)
+        path = os.path.join(point_folder, 'config.json')
+        with open(path, 'w') as f:
+            json.dump(config, f, indent=1)
+        # Fail before the first run instead of in the middle of the sweep
+        try:
+            test_parameters = prepare_test.get_config_parameters(argparse.Namespace(config=path))
+        except AssertionError as e:
+            raise ValueError("invalid point {}: {}".format(describe(params), e))
+        prepared.append((point, path, test_parameters['repeat_test'], params))
+    return prepared
+
+def run_point(config, workspace, processes):
+    """
+    Run a single repeat of a point in its workspace
+    :return: exit code and the records of the run
+    """
+    records = os.path.join(workspace, runs_file)
+    # Leftover of an interrupted attempt
+    if os.path.exists(records):
+        os.remove(records)
+    code = run_in_workspace(config, workspace, processes)
+    return code, read_runs(records)
+
+def run_sweep(config, folder=None, store_path=None, workers=None, processes=None):
+    """
+    Run every repeat of every point of a sweep config that is not finished yet, bounded by the number of CPU cores.
+    Every run executes in its own workspace (see run_test.run_in_workspace) and is checkpointed in the store
+    as soon as it ends, so running the same sweep again resumes where it stopped and retries failed runs.
+    :param config: path of the sweep config file
+    :param folder: directory of the point configs and workspaces, results/sweep_<config name> by default
+    :param store_path: sqlite file of the results, <folder>/sweep.db by default
+    :param workers: number of concurrent runs, parallel_runs of the config by default
+    :param processes: number of processes estimating hop capacities in every run
+    :return: True if all runs succeeded
+    """
+    with open(config) as f:
+        data = json.load(f)
+    if folder is None:
+        name = os.path.splitext(os.path.basename(config))[0]
+        folder = os.path.join(dir_path, 'results', 'sweep_' + name)
+    if store_path is None:
+        store_path = os.path.join(folder, 'sweep.db')
+
+    store = ResultsStore(store_path)
+    try:
+        points = prepare_points(data, folder, store)
+        jobs = []
+        for point, path, repeats, params in points:
+            finished = store.finished(point)
+            for repeat in range(1, repeats + 1):
+                if repeat not in finished:
+                    workspace = os.path.join(os.path.dirname(path), 'run_{:03d}'.format(repeat))
+                    jobs.append((point, repeat, path, workspace, params))
+        total = sum(p[2] for p in points)
+        print("{} points, {} runs, {} finished, {} to run".format(len(points), total, total - len(jobs), len(jobs)))
+
+        cores = multiprocessing.cpu_count()
+        if workers is None:
+            workers = data.get('parallel_runs', 1)
+        workers = max(1, min(workers, cores, max(len(jobs), 1)))
+        # Share the cores between the hop estimations of concurrent runs
+        if processes is None and data.get('processes') is None:
+            processes = max(1, cores // workers)
+
+        failed = 0
+        with ThreadPoolExecutor(workers) as pool:
+            futures = {pool.submit(run_point, job[2], job[3], processes): job for job in jobs}
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    point, repeat, path, workspace, params = futures[future]
+                    code, records = future.result()
+                    if code == 0 and records:
+                        store.add_run(point, repeat, records[-1], workspace)
+                        status = "done"
+                    else:
+                        store.add_failure(point, repeat, code, workspace)
+                        status = "failed with exit code {}, see {}".format(code, os.path.join(workspace, 'output.txt'))
+                        failed += 1
+                    print("[{}/{}] {} repeat {}: {}".format(done, len(jobs), describe(params), repeat, status))
+            except KeyboardInterrupt:
+                # Runs in progress are interrupted as well and repeated on resume
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        store.close()
+
+    print("results stored in {}".format(store_path))
+    return failed == 0
+
+def main():
+    """
+    Run a parameter sweep: every parameter of the config file may be a list of values or a
+    {"range": [start, stop, step]} object, the sweep runs every combination of them
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', help='Path to the sweep config file')
+    parser.add_argument('--workers', type=int, help='number of concurrent runs (default: parallel_runs of the config)')
+    parser.add_argument('--processes', type=int, help='number of processes estimating hop capacities in every run')
+    parser.add_argument('--folder', help='directory of the point configs and workspaces (default: results/sweep_<config name>)')
+    parser.add_argument('--store', help='sqlite file of the results (default: <folder>/sweep.db)')
+    args = parser.parse_args()
+
+    success = run_sweep(args.config, args.folder, args.store, args.workers, args.processes)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()